@@ -26,8 +26,15 @@ def setup_bot():
     yield db.users.save(data)
 
 
+# indexes replaced by the compound ones below
+REDUNDANT_INDEXES = {
+    'results': ['login_hashed', 'board_size_hashed', 'score_hashed'],
+}
+
+
 @tornado.gen.coroutine
 def ensure_indexes():
+    # User.get
     yield db.users.ensure_index([
         ('token', pymongo.HASHED),
     ])
@@ -36,17 +43,110 @@ def ensure_indexes():
         ('login', pymongo.HASHED),
     ])
 
-    yield db.results.ensure_index([
-        ('login', pymongo.HASHED),
+    # Result.get_best, best results of a board size
+    yield db.results.create_index([
+        ('board_size', pymongo.ASCENDING),
+        ('score', pymongo.DESCENDING),
+        ('login', pymongo.DESCENDING),
     ])
 
-    yield db.results.ensure_index([
-        ('board_size', pymongo.HASHED),
-    ])
+    # Result.submit, upserts of the result of a login; unique, so
+    # concurrent upserts can not insert a second result
+    yield remove_duplicate_results()
+    existing = yield db.results.index_information()
+    name = 'login_1_board_size_1'
+    if name in existing and not existing[name].get('unique'):
+        yield db.results.drop_index(name)
+    yield db.results.create_index([
+        ('login', pymongo.ASCENDING),
+        ('board_size', pymongo.ASCENDING),
+    ], unique=True)
+
+    for collection, names in REDUNDANT_INDEXES.items():
+        existing = yield db[collection].index_information()
+        for name in names:
+            if name in existing:
+                yield db[collection].drop_index(name)
+
+
+@tornado.gen.coroutine
+def remove_duplicate_results():
+    """
+    Keep only the best result of every login and board size, the one
+    reached first of equal ones. Results were stored per game before.
+    """
+    seen = set()
+    to_remove = []
+    cursor = db.results.find(
+        projection=['login', 'board_size'],
+        sort=[
+            ('login', pymongo.ASCENDING),
+            ('board_size', pymongo.ASCENDING),
+            ('score', pymongo.DESCENDING),
+            ('date', pymongo.ASCENDING),
+        ],
+    )
+    while (yield cursor.fetch_next):
+        result = cursor.next_object()
+        key = (result['login'], result['board_size'])
+        if key in seen:
+            to_remove.append(result['_id'])
+        else:
+            seen.add(key)
+
+    if to_remove:
+        yield db.results.remove({'_id': {'$in': to_remove}})
+
+
+def get_hot_queries():
+    """
+    Cursors of the queries run on every request or page view.
+    """
+    return {
+        'User.get by token': db.users.find({'token': BOT_TOKEN}),
+        'User.get by login': db.users.find({'login': 'stxnext'}),
+        'Result.get_best': db.results.find(
+            {'board_size': 5},
+            sort=[('score', pymongo.DESCENDING), ('login', pymongo.DESCENDING)]
+        ),
+        'Result.submit': db.results.find(
+            {'login': 'stxnext', 'board_size': 5}
+        ),
+    }
+
+
+def has_stage(plan, stage):
+    """
+    Returns True if the query plan (from explain) has the given stage.
+    All nested plans are searched, stages are found under inputStage and
+    inputStages, and under queryPlan when the slot based engine is used.
+    """
+    if isinstance(plan, list):
+        return any(has_stage(child, stage) for child in plan)
+    if not isinstance(plan, dict):
+        return False
+    if plan.get('stage') == stage:
+        return True
+    return any(has_stage(child, stage) for child in plan.values())
 
-    yield db.results.ensure_index([
-        ('score', pymongo.HASHED),
-    ])
+
+@tornado.gen.coroutine
+def verify_indexes():
+    """
+    Explain hot queries, fail if any of them scans the whole collection.
+    """
+    failed = []
+    for name, cursor in sorted(get_hot_queries().items()):
+        explain = yield cursor.explain()
+        plan = explain['queryPlanner']['winningPlan']
+        if has_stage(plan, 'COLLSCAN'):
+            failed.append(name)
+            print('{}: collection scan'.format(name))
+        else:
+            print('{}: OK'.format(name))
+
+    if failed:
+        sys.exit('Queries without index: {}'.format(', '.join(failed)))
 
 
 @tornado.gen.coroutine
@@ -95,6 +195,11 @@ def migrate_names():
 
 
 if __name__ == '__main__':
-    tornado.ioloop.IOLoop.current().run_sync(ensure_indexes)
+    if '--verify' in sys.argv[1:]:
+        tornado.ioloop.IOLoop.current().run_sync(verify_indexes)
+        sys.exit()
+
     tornado.ioloop.IOLoop.current().run_sync(setup_bot)
+    # logins are migrated first, renamed results may be duplicates
     tornado.ioloop.IOLoop.current().run_sync(migrate_names)
+    tornado.ioloop.IOLoop.current().run_sync(ensure_indexes)
@@ -1,41 +1,92 @@
+import concurrent.futures
+import copy
+import hashlib
 import logging
 import random
+import struct
 import subprocess
-import time
 
+from collections import namedtuple
 from datetime import datetime
 
+import tornado.escape
 import tornado.gen
 import tornado.locks
+from tornado.concurrent import Future
 from tornado.ioloop import IOLoop
 
 import settings
+from leaderboard import Leaderboard
 from result import Result
+from scheduler import RoomScheduler
+from write_queue import WriteQueue
+from sharding import shard_of
+from grotlogic.batch import start_moves
 from grotlogic.board import Board
 from grotlogic.game import Game
+from grotlogic.tape import Tape
 
 
 log = logging.getLogger('grot-server')
 
+# computes moves of big boards without blocking the IOLoop, see
+# GameRoom.Player.compute_move
+move_executor = (
+    concurrent.futures.ThreadPoolExecutor(settings.MOVE_WORKERS)
+    if settings.MOVE_WORKERS else None
+)
+
 
 class RoomIsFullException(Exception):
     pass
 
 
+Encoded = namedtuple('Encoded', ['body', 'etag'])
+
+
+def encode(data):
+    """
+    Encode data to JSON the way RequestHandler.write does and compute its
+    ETag, so the result can be shared by all clients waiting for it.
+    """
+    body = tornado.escape.utf8(tornado.escape.json_encode(data))
+    return Encoded(body, '"{}"'.format(hashlib.sha1(body).hexdigest()))
+
+
 class GameRoom(object):
     collection = settings.db['rooms']
+    # updates of rooms already stored in the database
+    writer = WriteQueue(
+        collection,
+        settings.ROOM_WRITE_INTERVAL,
+        settings.ROOM_WRITE_BATCH_SIZE,
+        settings.ROOM_WRITE_MAX_PENDING,
+    )
 
     TIMEOUT = 10
+    batch_moves = settings.BATCH_MOVES
+    scheduler = RoomScheduler()
+    # timeouts visible in the room status
+    STATUS_TIMEOUTS = ('_auto_start', '_auto_restart')
 
     class Player(Game):
+        MOVED_HEADER = struct.Struct('!hh')
 
-        def __init__(self, user, alias, allow_multi, board):
+        def __init__(self, user, alias, allow_multi, board, room=None):
             super(GameRoom.Player, self).__init__(board)
 
             self.user = user
             self.alias = alias
+            self.room = room
             self.ready = tornado.locks.Event()
+            # waiting for the move in the current round
+            self.pending = False
+            # the move was sent and is being computed
+            self.moving = False
             self.moved = None
+            # changed on every move, encoded state is cached per version
+            self.version = 0
+            self._encoded = {}
             self.inactive = False
             self.allow_multi = allow_multi
 
@@ -44,23 +95,79 @@ class GameRoom(object):
                 super(GameRoom.Player, self).start_move(x, y)
             finally:
                 self.moved = (x, y)
-                self.ready.set()
+                self.set_ready()
+
+        @tornado.gen.coroutine
+        def compute_move(self, x, y):
+            """
+            Make the move like start_move, but in the move executor when it
+            is set up, or together with moves of other players when the
+            round closes in rooms with batch moves. The move is computed on
+            a copy of the game, so clients see the state from before the move
+            until it is done. Moves of one room are computed one by one, in
+            the order they came.
+            """
+            if self.room is not None and self.room.batch_moves:
+                yield self.room.queue_move(self, x, y)
+                return
+
+            if move_executor is None or self.room is None:
+                self.start_move(x, y)
+                return
+
+            self.moving = True
+            try:
+                with (yield self.room.move_lock.acquire()):
+                    game = copy.copy(self)
+                    yield IOLoop.current().run_in_executor(
+                        move_executor, game.start_move, x, y
+                    )
+                    self.merge(game)
+            finally:
+                self.moving = False
+                self.moved = (x, y)
+                self.set_ready()
 
         def skip_move(self):
             try:
                 super(GameRoom.Player, self).skip_move()
             finally:
                 self.moved = None
-                self.ready.set()
+                self.set_ready()
 
-        def get_state(self, board=True):
-            state = super(GameRoom.Player, self).get_state(board)
+        def set_ready(self):
+            self.version += 1
+            self.ready.set()
+            if self.room is not None:
+                self.room._player_ready(self)
+
+        def get_state(self, board=True, since=None):
+            state = super(GameRoom.Player, self).get_state(board, since)
             state.update({
                 'moved': self.moved
             })
 
             return state
 
+        def get_encoded_state(self, board=True):
+            """
+            Returns state encoded to JSON, shared by all clients.
+            """
+            version, encoded = self._encoded.get(board, (None, None))
+            if version != self.version:
+                encoded = encode(self.get_state(board))
+                self._encoded[board] = (self.version, encoded)
+            return encoded
+
+        def pack_state(self, board=True):
+            """
+            Packed status of the game preceded by coordinates of the last
+            move, -1 when the move was skipped.
+            """
+            x, y = self.moved or (-1, -1)
+            return self.MOVED_HEADER.pack(x, y) + \
+                super(GameRoom.Player, self).pack_state(board)
+
         def get_id(self):
             player_id = str(self.user.id)
             if self.allow_multi and self.alias:
@@ -78,6 +185,7 @@ class GameRoom(object):
                  allow_multi=False, author=None, timestamp=None,
                  results=None, _id=None):
         self._removed = False
+        self._stored = False
         self._id = _id
         self.board_size = board_size
         self.title = title or 'Game {:%Y%m%d%H%M%S}'.format(datetime.now())
@@ -95,30 +203,54 @@ class GameRoom(object):
         }
 
         self.seed = random.getrandbits(128)
+        self.tape = Tape(self.seed)
         self.round = 0
 
         self.on_change = tornado.locks.Condition()
         self.on_end = tornado.locks.Condition()
         self.on_progress = tornado.locks.Condition()
+        self.on_status = tornado.locks.Condition()
+        self.move_lock = tornado.locks.Lock()
+        self.status_version = 0
+        self._status_etag = (None, None)
 
         self._players = {}
-        self._future = {}
+        self.leaderboard = Leaderboard()
+        # changed whenever results change, results are cached per version
+        self.version = 0
+        self._results = (None, None)
+        self._encoded_results = (None, None)
+
+        # round barrier: players still expected to move in this round and
+        # players who moved and are still active
+        self._pending = 0
+        self._active = 0
+        # moves waiting for the end of the round in rooms with batch moves,
+        # player -> (x, y, future)
+        self._moves = {}
 
         self.setup_timeout('_auto_start')
 
     @classmethod
     @tornado.gen.coroutine
-    def get_all(cls):
+    def get_all(cls, shard=None):
+        """
+        Load game rooms, only those owned by the shard (number, count) if
+        given.
+        """
         result = {}
         cursor = GameRoom.collection.find()
         while (yield cursor.fetch_next):
-            game_room = cls(**cursor.next_object())
+            data = cursor.next_object()
+            if shard and shard_of(str(data['_id']), shard[1]) != shard[0]:
+                continue
+            game_room = cls(**data)
+            game_room._stored = True
             result[game_room.room_id] = game_room
         return result
 
     @tornado.gen.coroutine
     def put(self):
-        saved = self._id is not None
         data = {
             'title': self.title,
             'board_size': self.board_size,
@@ -132,19 +264,26 @@ class GameRoom(object):
             'results': self.results,
         }
 
-        if saved:
+        if self._id is not None:
             data['_id'] = self._id
 
         if self._removed:
             log.warn('Updating already removed game room is not allowed!')
+        elif self._stored:
+            yield self.writer.put(self._id, data)
         else:
+            # new room is saved at once, its id is needed
             self._id = yield GameRoom.collection.save(to_save=data)
+            self._stored = True
 
     @tornado.gen.coroutine
     def remove(self):
+        self._removed = True
         if self._id is not None:
+            # queued update would bring the room back
+            yield self.writer.discard(self._id)
             yield GameRoom.collection.remove({'_id': self._id})
-        self._removed = True
+        self.scheduler.cancel_all(self)
 
     @property
     def room_id(self):
@@ -153,6 +292,17 @@ class GameRoom(object):
     def __lt__(self, other):
         return self.timestamp > other.timestamp
 
+    def get_summary(self):
+        """
+        Room details needed to list it, see sharding.RoomSummary.
+        """
+        return {
+            'room_id': self.room_id,
+            'title': self.title,
+            'author': self.author,
+            'timestamp': self.timestamp.timestamp(),
+        }
+
     def get_player(self, user, alias=''):
         player_id = user if isinstance(user, str) else str(user.id)
         if self.allow_multi and alias:
@@ -160,28 +310,66 @@ class GameRoom(object):
 
         return self._players[player_id]
 
+    def notify_change(self):
+        self.version += 1
+        self.on_change.notify_all()
+
+    def notify_status(self):
+        self.status_version += 1
+        self.on_status.notify_all()
+
     def update_timestamp(self):
         self.timestamp = datetime.now()
 
     def setup_timeout(self, timeout_name):
         delay = self._delays.get(timeout_name)
         if delay:
-            self.cancel_timeout(timeout_name)
-
-            self._future[timeout_name] = IOLoop.instance().call_later(
-                delay, getattr(self, timeout_name)
-            )
+            self.scheduler.schedule(self, timeout_name, delay)
+            if timeout_name in self.STATUS_TIMEOUTS:
+                self.notify_status()
 
     def cancel_timeout(self, timeout_name):
-        handle = self._future.get(timeout_name)
-        if handle:
-            IOLoop.instance().remove_timeout(handle)
-            del self._future[timeout_name]
+        if self.scheduler.cancel(self, timeout_name):
+            if timeout_name in self.STATUS_TIMEOUTS:
+                self.notify_status()
 
     def get_deadline(self, timeout_name):
-        handle = self._future.get(timeout_name)
-        if handle:
-            return int(handle.deadline - time.time())
+        remaining = self.scheduler.get_remaining(self, timeout_name)
+        if remaining is not None:
+            return int(remaining)
+
+    def get_deadline_timestamp(self, timeout_name):
+        """
+        Returns UNIX timestamp of the deadline, so clients can count down
+        on their own.
+        """
+        timestamp = self.scheduler.get_deadline_timestamp(self, timeout_name)
+        if timestamp is not None:
+            return int(timestamp)
+
+    def get_status(self):
+        return {
+            'started': self.started,
+            'ended': self.ended,
+            'start_in': self.get_deadline('_auto_start'),
+            'restart_in': self.get_deadline('_auto_restart'),
+            'start_at': self.get_deadline_timestamp('_auto_start'),
+            'restart_at': self.get_deadline_timestamp('_auto_restart'),
+        }
+
+    def get_status_etag(self):
+        """
+        Returns ETag of the status. Countdowns are left out, so it changes
+        only when the room status changes.
+        """
+        version, etag = self._status_etag
+        if version != self.status_version:
+            status = self.get_status()
+            del status['start_in']
+            del status['restart_in']
+            etag = encode(status).etag
+            self._status_etag = (self.status_version, etag)
+        return etag
 
     @property
     def started(self):
@@ -193,12 +381,7 @@ class GameRoom(object):
 
     @property
     def players(self):
-        players = list(self._players.values())
-        players.sort(
-            key=lambda player: (player.score, player.moves),
-            reverse=True,
-        )
-        return players
+        return list(self.leaderboard)
 
     @property
     def players_active(self):
@@ -212,8 +395,8 @@ class GameRoom(object):
     def players_unready(self):
         return (
             player
-            for player in self.players_active
-            if not player.ready.is_set()
+            for player in self._players.values()
+            if player.pending
         )
 
     def add_player(self, user, alias=''):
@@ -221,7 +404,7 @@ class GameRoom(object):
         if self.max_players and len(self._players) < self.max_players:
             player = self.Player(
                 user, alias, self.allow_multi,
-                Board(self.board_size, self.seed)
+                Board(self.board_size, tape=self.tape), self
             )
             player_id = player.get_id()
 
@@ -230,8 +413,9 @@ class GameRoom(object):
                 self._players[player_id].inactive = True
 
             self._players[player_id] = player
+            self.leaderboard.update(player_id, player)
 
-            self.on_change.notify_all()
+            self.notify_change()
         else:
             raise RoomIsFullException()
 
@@ -260,18 +444,23 @@ class GameRoom(object):
             else:
                 self.cancel_timeout('_auto_start')
                 self._new_round()
-                self.on_change.notify_all()
+                self.notify_change()
+                self.notify_status()
 
     def _new_round(self):
         self.update_timestamp()
         self.round += 1
 
+        self._pending = 0
+        self._active = 0
         for player in self.players_active:
             player.ready.clear()
+            player.pending = True
+            self._pending += 1
 
-            IOLoop.instance().add_future(
-                player.ready.wait(), self._player_ready
-            )
+        if not self._pending:
+            self._end_game()
+            return
 
         self.setup_timeout('_end_round')
 
@@ -279,66 +468,141 @@ class GameRoom(object):
 
     def _end_round(self):
         self.update_timestamp()
-        for player in self.players_unready:
-            player.skip_move()
-
-    def _player_ready(self, future):
+        current_round = self.round
+        for player in list(self.players_unready):
+            # skipped moves may complete the round together with queued
+            # moves, players of the next round must not be skipped
+            if self.round != current_round:
+                break
+            # moves sent in time count even if they are still computed
+            if player.pending and not player.moving:
+                player.skip_move()
+
+    def _player_ready(self, player):
         self.update_timestamp()
-        self.on_change.notify_all()
+        self.leaderboard.update(player.get_id(), player)
+        self.notify_change()
+
+        if not player.pending:
+            return
 
-        if any(self.players_unready):
+        player.pending = False
+        self._pending -= 1
+        if player.is_active():
+            self._active += 1
+
+        if self._pending:
+            if len(self._moves) == self._pending:
+                self._commit_moves()
             return
 
         self.cancel_timeout('_end_round')
 
-        if any(self.players_active):
+        if self._active:
             self._new_round()
         else:
-            # save results
-            self.results = self.get_results()
-            IOLoop.current().spawn_callback(self.put)
-            IOLoop.current().spawn_callback(self.submit_result)
-            self.setup_timeout('_auto_restart')
-            self.on_end.notify_all()
+            self._end_game()
+
+    def queue_move(self, player, x, y):
+        """
+        Queue the move until every player of the round moved or the round
+        times out, then make all of them at once. Returns a future resolved
+        when the move is made. Another move of the player in the same round
+        replaces the queued one.
+        """
+        if player in self._moves:
+            future = self._moves[player][2]
+        else:
+            future = Future()
+        player.moving = True
+        self._moves[player] = (x, y, future)
+        if len(self._moves) == self._pending:
+            self._commit_moves()
+        return future
+
+    def _commit_moves(self):
+        moves, self._moves = self._moves, {}
+        try:
+            start_moves(
+                list(moves),
+                [(x, y) for x, y, future in moves.values()],
+            )
+        except Exception as e:
+            error = e
+        else:
+            error = None
+
+        for player, (x, y, future) in moves.items():
+            player.moving = False
+            player.moved = (x, y)
+            player.set_ready()
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    def _end_game(self):
+        # save results
+        self.results = self.get_results()
+        IOLoop.current().spawn_callback(self.put)
+        IOLoop.current().spawn_callback(self.submit_result)
+        self.setup_timeout('_auto_restart')
+        self.on_end.notify_all()
+        self.notify_status()
 
     def get_results(self):
         if self.results:
             return self.results
 
-        return [
-            {
-                'id': player.get_id(),
-                'login': player.get_login(),
-                'score': player.score,
-                'moves': player.moves,
-            }
-            for player in self.players
-        ]
+        version, results = self._results
+        if version != self.version:
+            results = [
+                {
+                    'id': player.get_id(),
+                    'login': player.get_login(),
+                    'score': player.score,
+                    'moves': player.moves,
+                }
+                for player in self.players
+            ]
+            self._results = (self.version, results)
+
+        return results
+
+    def get_encoded_results(self):
+        """
+        Returns results encoded to JSON, shared by all clients.
+        """
+        version, encoded = self._encoded_results
+        if version != (self.version, self.ended):
+            encoded = encode({'players': self.get_results()})
+            self._encoded_results = ((self.version, self.ended), encoded)
+        return encoded
 
     @tornado.gen.coroutine
     def submit_result(self):
+        scores = {}
         for result in self.get_results():
             if result['score'] > settings.MIN_HOF_SCORE:
                 login = result['login']
                 if ' ' in login:
                     login = login.split(' ')[0]
-                lowest = yield Result.get_last(login, self.board_size)
-                if lowest is None or lowest.score < result['score']:
-                    result = Result(
-                        login=login,
-                        score=result['score'],
-                        board_size=self.board_size,
-                    )
+                scores[login] = max(scores.get(login, 0), result['score'])
 
-                    yield result.put()
+        if scores:
+            yield Result.submit(self.board_size, scores)
 
     def _auto_restart(self):
         self.cancel_timeout('_auto_restart')
         self._players = {}
+        self.leaderboard.clear()
+        self.version += 1
         self.seed = random.getrandbits(128)
+        self.tape = Tape(self.seed)
         self.round = 0
         self.results = None
         self.setup_timeout('_auto_start')
+        self.notify_status()
 
     def add_bot(self):
         subprocess.Popen(
@@ -363,6 +627,11 @@ class DevGameRoom(GameRoom):
             finally:
                 self.ready.clear()
 
+        @tornado.gen.coroutine
+        def compute_move(self, x, y):
+            # boards of the development room are small
+            self.start_move(x, y)
+
         def skip_move(self):
             pass
 
@@ -387,6 +656,9 @@ class DevGameRoom(GameRoom):
         except LookupError:
             return self.add_player(user, alias)
 
+    def _player_ready(self, player):
+        pass
+
     def start(self):
         pass
 
@@ -0,0 +1,166 @@
+import functools
+
+from .board import UP, DOWN, RIGHT, LEFT
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# direction of the cell standing for everything outside of the boards
+OUTSIDE = LEFT + 1
+
+
+@functools.lru_cache(maxsize=64)
+def get_neighbours(size, count):
+    """
+    Index of the neighbour field in every direction (by direction code) for
+    `count` boards of the given size stacked into one flat array. Fields on
+    the edge lead to the last, outside cell. Tables are cached, rooms keep
+    the number of players between rounds.
+    """
+    fields = size * size
+    outside = count * fields
+    index = numpy.arange(outside + 1)
+    board_index = index % fields
+    x = index % size
+
+    neighbours = numpy.full((OUTSIDE + 1, outside + 1), outside)
+    neighbours[UP] = numpy.where(board_index >= size, index - size, outside)
+    neighbours[DOWN] = numpy.where(
+        board_index + size < fields, index + size, outside
+    )
+    neighbours[RIGHT] = numpy.where(x < size - 1, index + 1, outside)
+    neighbours[LEFT] = numpy.where(x > 0, index - 1, outside)
+    neighbours[:, outside] = outside
+    neighbours.flags.writeable = False
+    return neighbours
+
+
+def can_batch(games):
+    """
+    Whether moves of the games can be made in one pass: NumPy is available,
+    boards have the same size, share the tape and are filled.
+    """
+    if numpy is None or not games:
+        return False
+    board = games[0].board
+    return all(
+        game.board.size == board.size and
+        game.board.tape is board.tape and
+        0 not in game.board.directions
+        for game in games
+    )
+
+
+def start_moves(games, moves):
+    """
+    Make one move, given as (x, y), in every game. Gives the same results as
+    Game.start_move called for every game, but boards are stacked into one
+    array, so chain reactions, gravity and refill of all of them run
+    together. Falls back to moves one by one when the games can not be
+    batched. Like the batched moves, they skip start_move, so subclasses
+    hooked into it (e.g. room players) are not notified.
+    """
+    if not can_batch(games):
+        for game, (x, y) in zip(games, moves):
+            game.moves -= 1
+            game.move_score, game.move_length = \
+                game.board.chain_reaction(x, y)
+            game.finish_move()
+        return
+
+    size = games[0].board.size
+    count = size * size
+    tape = games[0].board.tape
+
+    points = numpy.frombuffer(
+        b''.join(game.board.points for game in games), dtype=numpy.uint8
+    ).reshape(-1, size, size)
+    directions = numpy.frombuffer(
+        b''.join(game.board.directions for game in games) + bytes((OUTSIDE,)),
+        dtype=numpy.uint8,
+    ).copy()
+
+    # all chain reactions advance together, one field at a time; passing a
+    # cleared field keeps the direction, so it is skipped
+    neighbours = get_neighbours(size, len(games))
+    index = numpy.array([
+        board_index * count + y * size + x
+        for board_index, (x, y) in enumerate(moves)
+    ])
+    direction = directions[index]
+    while index.size:
+        current = directions[index]
+        direction = numpy.where(current != 0, current, direction)
+        directions[index] = 0
+        index = neighbours[direction, index]
+
+        inside = directions[index] != OUTSIDE
+        index = index[inside]
+        direction = direction[inside]
+
+    # fields are indexed by [board, y, x] from now on
+    directions = directions[:-1].reshape(-1, size, size)
+    filled = directions != 0
+    score = (points * ~filled).sum(axis=(1, 2))
+    length = (~filled).sum(axis=(1, 2))
+    empty_lines = (
+        (~filled.any(axis=2)).sum(axis=1) + (~filled.any(axis=1)).sum(axis=1)
+    )
+
+    # fields from the top of a column down to its lowest cleared field are
+    # changed by gravity and refill
+    lowest = size - 1 - (~filled)[:, ::-1, :].argmax(axis=1)
+    lowest[filled.all(axis=1)] = -1
+    changed = numpy.arange(size)[None, :, None] <= lowest[:, None, :]
+    changed_count = changed.sum(axis=(1, 2)).tolist()
+    changed = numpy.nonzero(changed.reshape(-1, count))[1].tolist()
+
+    # gravity: stable sort of every column puts cleared fields on the top
+    order = numpy.argsort(filled, axis=1, kind='stable')
+    points = numpy.take_along_axis(points, order, axis=1)
+    directions = numpy.take_along_axis(directions, order, axis=1)
+
+    # refill column by column, top to bottom, fields are [board, x, y] here
+    points = points.transpose(0, 2, 1).reshape(-1, count)
+    directions = directions.transpose(0, 2, 1).reshape(-1, count)
+    empty = directions == 0
+    missing = empty.sum(axis=1)
+    positions = numpy.array([game.board.position for game in games])
+
+    start = int(positions.min())
+    end = int((positions + missing).max())
+    if end > len(tape):
+        tape.extend(end)
+    tape_points = numpy.frombuffer(tape.points[start:end], dtype=numpy.uint8)
+    tape_directions = numpy.frombuffer(
+        tape.directions[start:end], dtype=numpy.uint8
+    )
+    offsets = (positions - start)[:, None] + empty.cumsum(axis=1) - 1
+    points[empty] = tape_points[offsets[empty]]
+    directions[empty] = tape_directions[offsets[empty]]
+
+    points = points.reshape(-1, size, size).transpose(0, 2, 1).tobytes()
+    directions = \
+        directions.reshape(-1, size, size).transpose(0, 2, 1).tobytes()
+    positions = (positions + missing).tolist()
+    extra_points = (empty_lines * size * 10).tolist()
+    score = score.tolist()
+    length = length.tolist()
+
+    first = 0
+    for board_index, game in enumerate(games):
+        fields = slice(board_index * count, (board_index + 1) * count)
+        last = first + changed_count[board_index]
+        game.board.load(
+            points[fields], directions[fields], positions[board_index],
+            changed[first:last],
+        )
+        first = last
+
+        game.moves -= 1
+        game.move_score = score[board_index] + extra_points[board_index]
+        game.move_length = length[board_index]
+        game.update_score()
@@ -1,134 +1,547 @@
 import random
+import threading
+from array import array
+from collections import deque, namedtuple
 
-from .field import Field
+from .field import DIRECTIONS, DIRECTION_NAMES, DIRECTION_CODES, BoardField
+from .tape import Tape
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-class Board(object):
+UP, DOWN, RIGHT, LEFT = range(1, len(DIRECTIONS) + 1)
+
+# direction code moved to the high four bits of a byte
+HIGH_NIBBLE = bytes((code << 4) & 0xff for code in range(256))
+
+BoardSnapshot = namedtuple('BoardSnapshot', [
+    'points', 'directions', 'row_counts', 'column_counts', 'empty_lines',
+    'dirty_columns', 'position',
+])
+
+
+class SkipPointers(object):
+    """
+    "Next non-empty field" pointers for every direction, used to jump over
+    runs of cleared fields during a chain reaction (union-find with path
+    compression along rows and columns).
+
+    Pointers are valid only within one generation, which lasts for a single
+    chain reaction, so they never have to be cleared. One instance is shared
+    by all boards of the same size in the current thread.
+    """
+    _local = threading.local()
 
-    def __init__(self, size, seed=None):
+    def __init__(self, size):
         self.size = size
-        self.seed = seed or random.getrandbits(128)
-        self.random = random.Random(seed)
+        self.generation = 0
+        count = size * size
+        self.parents = [None] + [[0] * count for _ in DIRECTIONS]
+        self.marks = [None] + [[0] * count for _ in DIRECTIONS]
 
-        self.fields = [
-            [Field(x, y, self.random) for y in range(size)]
-            for x in range(size)
+        # index of the neighbour field in every direction, -1 outside of the
+        # board
+        self.neighbours = [None] * (len(DIRECTIONS) + 1)
+        self.neighbours[LEFT] = [
+            index - 1 if index % size else -1 for index in range(count)
         ]
+        self.neighbours[RIGHT] = [
+            index + 1 if (index + 1) % size else -1 for index in range(count)
+        ]
+        self.neighbours[UP] = [
+            index - size if index >= size else -1 for index in range(count)
+        ]
+        self.neighbours[DOWN] = [
+            index + size if index + size < count else -1
+            for index in range(count)
+        ]
+
+    @classmethod
+    def get(cls, size):
+        """
+        Returns pointers for boards of the given size, starting a new
+        generation.
+        """
+        try:
+            cache = cls._local.cache
+        except AttributeError:
+            cache = cls._local.cache = {}
+
+        try:
+            skips = cache[size]
+        except KeyError:
+            skips = cache[size] = cls(size)
+
+        skips.generation += 1
+        return skips
+
+    def next_index(self, directions, index, direction):
+        """
+        Returns index of the first not cleared field after the given one or
+        -1 if the chain leaves the board.
+        """
+        neighbours = self.neighbours[direction]
+        index = neighbours[index]
+        if index < 0 or directions[index]:
+            return index
+
+        parents = self.parents[direction]
+        marks = self.marks[direction]
+        generation = self.generation
+
+        path = []
+        while index >= 0 and not directions[index]:
+            path.append(index)
+            if marks[index] == generation:
+                index = parents[index]
+            else:
+                # field was cleared in this generation, link it to neighbour
+                marks[index] = generation
+                index = neighbours[index]
+
+        for cleared in path:
+            parents[cleared] = index
+
+        return index
+
+
+class Board(object):
+    """
+    Holds the board state in two flat byte arrays (points and directions),
+    one byte per field, row by row (index = y * size + x). Direction 0 means
+    that the field was cleared.
+
+    Number of not cleared fields in every row and column is kept up to date,
+    together with the number of empty lines, so extra points do not need
+    a scan of the board. Columns with cleared fields are remembered, so
+    gravity and refill touch only them.
+
+    New fields are read from a tape of random fields. Boards of the same size
+    sharing a tape start equal and get the same new fields.
+
+    Snapshots share the arrays with the board (copy on write), the arrays
+    are copied only when the board is changed after a snapshot was taken.
+
+    Every change of the board gets a new version. Changed fields of the last
+    versions are kept, so clients can ask only for fields changed since the
+    version they already have.
+    """
+    HISTORY_SIZE = 8
+
+    def __init__(self, size, seed=None, tape=None):
+        self.size = size
+        if tape is None:
+            self.seed = seed or random.getrandbits(128)
+            tape = Tape(seed)
+        else:
+            self.seed = tape.seed
+        self.tape = tape
+
+        points, directions = tape.get_initial(size)
+        self.points = bytearray(points)
+        self.directions = bytearray(directions)
+        self.position = size * size
+        self.row_counts = array('H', [size]) * size
+        self.column_counts = array('H', [size]) * size
+        self.empty_lines = 0
+        self.dirty_columns = set()
+        self._shared = False
+
+        self.version = 0
+        self._changed = set()
+        self._changed_all = False
+        self._history = deque(maxlen=self.HISTORY_SIZE)
 
     def __copy__(self):
-        return Board(self.size, self.seed)
+        board = Board.__new__(Board)
+        board.size = self.size
+        board.seed = self.seed
+        board.tape = self.tape
+        board.version = 0
+        board._changed = set()
+        board._history = deque(maxlen=self.HISTORY_SIZE)
+        board.restore(self.snapshot())
+        # the copy starts without pending changes
+        board._changed_all = False
+        return board
+
+    def snapshot(self):
+        """
+        Returns the current state of the board. The snapshot shares arrays
+        with the board until one of them is changed.
+        """
+        self._shared = True
+        return BoardSnapshot(
+            self.points,
+            self.directions,
+            self.row_counts,
+            self.column_counts,
+            self.empty_lines,
+            frozenset(self.dirty_columns),
+            self.position,
+        )
+
+    def restore(self, snapshot):
+        """
+        Bring the board back to the state from the snapshot.
+        """
+        self.points = snapshot.points
+        self.directions = snapshot.directions
+        self.row_counts = snapshot.row_counts
+        self.column_counts = snapshot.column_counts
+        self.empty_lines = snapshot.empty_lines
+        self.dirty_columns = set(snapshot.dirty_columns)
+        self.position = snapshot.position
+        self._shared = True
+        # every field may have changed
+        self._changed_all = True
+
+    def load(self, points, directions, position, changed):
+        """
+        Replace fields by a filled board computed elsewhere (see
+        batch.start_moves), read up to the given tape position. Indices of
+        changed fields are tracked as usual.
+        """
+        size = self.size
+        self.points = bytearray(points)
+        self.directions = bytearray(directions)
+        self.position = position
+        self.row_counts = array('H', [size]) * size
+        self.column_counts = array('H', [size]) * size
+        self.empty_lines = 0
+        self.dirty_columns = set()
+        self._shared = False
+        self._changed.update(changed)
+
+    def merge(self, other):
+        """
+        Take over the state of a copy of the board. Fields changed on the copy
+        are reported as changed by this board.
+        """
+        changed_all = self._changed_all or other._changed_all
+        self.restore(other.snapshot())
+        self._changed_all = changed_all
+        self._changed |= other._changed
+
+    def _unshare(self):
+        """
+        Copy arrays shared with snapshots before changing them.
+        """
+        if self._shared:
+            self.points = bytearray(self.points)
+            self.directions = bytearray(self.directions)
+            self.row_counts = array('H', self.row_counts)
+            self.column_counts = array('H', self.column_counts)
+            self._shared = False
+
+    def as_array(self):
+        """
+        Returns NumPy views of points and directions indexed by [y, x].
+        Changes made through the views are not tracked.
+        """
+        if numpy is None:
+            raise RuntimeError('NumPy is required for the array view.')
+
+        self._unshare()
+        shape = (self.size, self.size)
+        points = numpy.frombuffer(self.points, dtype=numpy.uint8)
+        directions = numpy.frombuffer(self.directions, dtype=numpy.uint8)
+        return points.reshape(shape), directions.reshape(shape)
+
+    def _field_filled(self, index):
+        y, x = divmod(index, self.size)
+
+        self.row_counts[y] += 1
+        if self.row_counts[y] == 1:
+            self.empty_lines -= 1
+
+        self.column_counts[x] += 1
+        if self.column_counts[x] == 1:
+            self.empty_lines -= 1
+
+    def _field_cleared(self, index):
+        y, x = divmod(index, self.size)
+
+        self.row_counts[y] -= 1
+        if not self.row_counts[y]:
+            self.empty_lines += 1
+
+        self.column_counts[x] -= 1
+        if not self.column_counts[x]:
+            self.empty_lines += 1
+
+        self.dirty_columns.add(x)
+
+    def set_points(self, index, points):
+        """
+        Set points of the field at the given index.
+        """
+        self._unshare()
+        self.points[index] = points
+        self._changed.add(index)
+
+    def set_direction(self, index, direction):
+        """
+        Set direction code of the field at the given index.
+        """
+        self._unshare()
+        if self.directions[index] and not direction:
+            self._field_cleared(index)
+        elif direction and not self.directions[index]:
+            self._field_filled(index)
+
+        self.directions[index] = direction
+        self._changed.add(index)
+
+    def reset_field(self, index):
+        """
+        Draw new points and direction for the field at the given index.
+        """
+        self._unshare()
+        tape = self.tape
+        if self.position >= len(tape):
+            tape.extend(self.position + 1)
+
+        self.points[index] = tape.points[self.position]
+        self.set_direction(index, tape.directions[self.position])
+        self.position += 1
 
     def get_field(self, x, y):
         """
         Returns the field at the given coordinates.
         """
-        return self.fields[x][y]
+        return BoardField(self, x, y)
 
     def get_next_field(self, field, direction=None):
         """
         Returns next field in chain reaction and information is it last step
         in this chain reaction.
         """
-        direction = field.direction or direction
+        index = field.y * self.size + field.x
+        code = self.directions[index] or DIRECTION_CODES[direction]
 
-        if direction == 'left':
-            if field.x == 0:
-                return None
-            next_field = self.get_field(field.x - 1, field.y)
+        skips = SkipPointers.get(self.size)
+        next_index = skips.next_index(self.directions, index, code)
+        if next_index < 0:
+            return None
 
-        elif direction == 'right':
-            if field.x == (self.size - 1):
-                return None
-            next_field = self.get_field(field.x + 1, field.y)
+        return self.get_field(next_index % self.size, next_index // self.size)
 
-        elif direction == 'up':
-            if field.y == 0:
-                return None
-            next_field = self.get_field(field.x, field.y - 1)
+    def chain_reaction(self, x, y):
+        """
+        Clear fields starting from the given one until the chain leaves the
+        board. Returns points of cleared fields and length of the chain.
+        """
+        self._unshare()
+        size = self.size
+        points = self.points
+        directions = self.directions
+        row_counts = self.row_counts
+        column_counts = self.column_counts
+        dirty_columns = self.dirty_columns
+        changed = self._changed
+        next_index = SkipPointers.get(size).next_index
+
+        score = 0
+        length = 0
+        empty_lines = 0
+        index = y * size + x
+        if not directions[index]:
+            raise ValueError('Field at {},{} is already cleared.'.format(x, y))
 
-        elif direction == 'down':
-            if field.y == (self.size - 1):
-                return None
-            next_field = self.get_field(field.x, field.y + 1)
+        while index >= 0:
+            direction = directions[index]
+            directions[index] = 0
+            score += points[index]
+            length += 1
 
-        if next_field.direction is None:
-            # if next was alread cleared than go further in the same direction
-            return self.get_next_field(next_field, direction)
+            y, x = divmod(index, size)
+            row_counts[y] -= 1
+            if not row_counts[y]:
+                empty_lines += 1
+            column_counts[x] -= 1
+            if not column_counts[x]:
+                empty_lines += 1
+            dirty_columns.add(x)
+            changed.add(index)
 
-        return next_field
+            index = next_index(directions, index, direction)
 
-    def lower_field(self, field):
+        self.empty_lines += empty_lines
+        return score, length
+
+    def lower_column(self, x):
         """
         When chain reaction is over fields that are 'flying' should be lowered.
+        Moves not cleared fields of the column to the bottom keeping their
+        order.
         """
-        new_y = field.y
-        while new_y < self.size - 1:
-            if self.get_field(field.x, new_y + 1).direction is not None:
-                # next field below is not empty, so finish lowering
-                break
-            new_y += 1
+        self._unshare()
+        size = self.size
+        points = self.points
+        directions = self.directions
+        row_counts = self.row_counts
+
+        bottom = size * (size - 1) + x
+        for index in range(bottom, -1, -size):
+            if directions[index]:
+                if index != bottom:
+                    # swap fields values
+                    points[index], points[bottom] = \
+                        points[bottom], points[index]
+                    directions[index], directions[bottom] = \
+                        directions[bottom], directions[index]
+
+                    # field moved from one row to another
+                    row_counts[index // size] -= 1
+                    if not row_counts[index // size]:
+                        self.empty_lines += 1
+                    row_counts[bottom // size] += 1
+                    if row_counts[bottom // size] == 1:
+                        self.empty_lines -= 1
 
-        if new_y != field.y:
-            next_field = self.get_field(field.x, new_y)
-            # swap fields values
-            field.points, next_field.points = next_field.points, field.points
-            field.direction, next_field.direction = \
-                next_field.direction, field.direction
+                    self._changed.add(index)
+                    self._changed.add(bottom)
+                bottom -= size
 
     def lower_fields(self):
         """
         Lower fields (use gravity).
         """
-        for y in reversed(range(self.size - 1)):
-            for x in range(self.size):
-                self.lower_field(self.get_field(x, y))
+        for x in sorted(self.dirty_columns):
+            self.lower_column(x)
 
     def fill_empty_fields(self):
         """
         Reset fields in empty places.
         """
-        for x in range(self.size):
-            for y in range(self.size):
-                field = self.get_field(x, y)
-                if field.direction is None:
-                    field.reset()
+        self._unshare()
+        size = self.size
+        points = self.points
+        directions = self.directions
+        row_counts = self.row_counts
+        column_counts = self.column_counts
+        changed = self._changed
+        tape = self.tape
+        position = self.position
+
+        missing = size * size - sum(row_counts)
+        if position + missing > len(tape):
+            tape.extend(position + missing)
+        tape_points = tape.points
+        tape_directions = tape.directions
+
+        # fields are drawn column by column, top to bottom, so the tape is
+        # read in the same order as when the whole board is filled
+        for x in sorted(self.dirty_columns):
+            for index in range(x, size * size, size):
+                if column_counts[x] == size:
+                    # after lowering empty fields are on the top
+                    break
+                if directions[index]:
+                    continue
+
+                points[index] = tape_points[position]
+                directions[index] = tape_directions[position]
+                position += 1
+                changed.add(index)
+
+                y = index // size
+                row_counts[y] += 1
+                if row_counts[y] == 1:
+                    self.empty_lines -= 1
+                column_counts[x] += 1
+                if column_counts[x] == 1:
+                    self.empty_lines -= 1
+
+        self.position = position
+        self.dirty_columns.clear()
 
     def get_extra_points(self):
         """
         Return extra points for the empty rows and columns.
         """
-        extra_points = 0
+        return self.empty_lines * self.size * 10
 
-        for x in range(self.size):
-            is_empty = True
-            for y in range(self.size):
-                if self.get_field(x, y).direction is not None:
-                    is_empty = False
-                    break
+    def get_version(self):
+        """
+        Returns version of the board, changes made since the last call get
+        a new version.
+        """
+        if self._changed_all:
+            self.version += 1
+            self._history.clear()
+            self._changed = set()
+            self._changed_all = False
+        elif self._changed:
+            self.version += 1
+            self._history.append(
+                (self.version, array('I', sorted(self._changed)))
+            )
+            self._changed = set()
 
-            if is_empty:
-                extra_points += self.size * 10
+        return self.version
 
-        for y in range(self.size):
-            is_empty = True
-            for x in range(self.size):
-                if self.get_field(x, y).direction is not None:
-                    is_empty = False
-                    break
+    def get_changes(self, version):
+        """
+        Get the status of fields changed since the given version or None if
+        the version is too old.
+        """
+        current = self.get_version()
+        if version == current:
+            return []
+        if not self._history or not \
+                self._history[0][0] - 1 <= version < current:
+            return None
 
-            if is_empty:
-                extra_points += self.size * 10
+        changed = set()
+        for changes_version, indices in self._history:
+            if changes_version > version:
+                changed.update(indices)
 
-        return extra_points
+        size = self.size
+        points = self.points
+        directions = self.directions
+        return [
+            {
+                'points': points[index],
+                'direction': DIRECTION_NAMES[directions[index]],
+                'x': index % size,
+                'y': index // size,
+            }
+            for index in sorted(changed)
+        ]
+
+    def pack(self):
+        """
+        Get the status of the board packed into bytes, one byte per field row
+        by row: direction code in the high and points in the low four bits.
+        """
+        count = self.size * self.size
+        directions = int.from_bytes(
+            self.directions.translate(HIGH_NIBBLE), 'big'
+        )
+        points = int.from_bytes(self.points, 'big')
+        return (directions | points).to_bytes(count, 'big')
 
     def get_state(self):
         """
         Get the status of the board.
         """
-        rows = []
-        for y in range(self.size):
-            row = []
-            for x in range(self.size):
-                row.append(self.get_field(x, y).get_state())
-            rows.append(row)
-        return rows
+        size = self.size
+        points = self.points
+        directions = self.directions
+        return [
+            [
+                {
+                    'points': points[y * size + x],
+                    'direction': DIRECTION_NAMES[directions[y * size + x]],
+                    'x': x,
+                    'y': y,
+                }
+                for x in range(size)
+            ]
+            for y in range(size)
+        ]
@@ -1,6 +1,11 @@
 POINTS = [1, 1, 1, 1, 2, 2, 2, 3, 3, 4]
 DIRECTIONS = ['up', 'down', 'right', 'left']
 
+# Directions are stored on the board as small integer codes, 0 means that
+# the field was cleared.
+DIRECTION_NAMES = [None] + DIRECTIONS
+DIRECTION_CODES = {name: code for code, name in enumerate(DIRECTION_NAMES)}
+
 
 class Field(object):
     """
@@ -24,3 +29,44 @@ class Field(object):
             'x': self.x,
             'y': self.y,
         }
+
+
+class BoardField(object):
+    """
+    Field stored in the board arrays. Behaves like Field, but keeps no state
+    on its own, so it is cheap to create on demand.
+    """
+    __slots__ = ('board', 'index', 'x', 'y')
+
+    def __init__(self, board, x, y):
+        self.board = board
+        self.index = y * board.size + x
+        self.x = x
+        self.y = y
+
+    @property
+    def points(self):
+        return self.board.points[self.index]
+
+    @points.setter
+    def points(self, value):
+        self.board.set_points(self.index, value)
+
+    @property
+    def direction(self):
+        return DIRECTION_NAMES[self.board.directions[self.index]]
+
+    @direction.setter
+    def direction(self, value):
+        self.board.set_direction(self.index, DIRECTION_CODES[value])
+
+    def reset(self):
+        self.board.reset_field(self.index)
+
+    def get_state(self):
+        return {
+            'points': self.points,
+            'direction': self.direction,
+            'x': self.x,
+            'y': self.y,
+        }
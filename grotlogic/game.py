@@ -1,3 +1,19 @@
+import copy
+import struct
+from collections import namedtuple
+
+from . import batch
+
+
+# score, moves, board version and board size
+STATE_HEADER = struct.Struct('!iiIH')
+
+GameSnapshot = namedtuple('GameSnapshot', ['score', 'moves', 'board'])
+MoveEvaluation = namedtuple('MoveEvaluation', [
+    'x', 'y', 'score', 'length', 'extra_moves', 'board',
+])
+
+
 class Game(object):
 
     def __init__(self, board):
@@ -5,17 +21,43 @@ class Game(object):
         self.score = 0
         self.moves = 5
 
-    def start_move(self, x, y):
+    def __copy__(self):
+        game = Game(copy.copy(self.board))
+        game.score = self.score
+        game.moves = self.moves
+        return game
+
+    def snapshot(self):
         """
-        Set initial values and start chain reaction.
+        Returns the current state of the game, see Board.snapshot.
         """
-        field = self.board.get_field(x, y)
-        self.moves -= 1
+        return GameSnapshot(self.score, self.moves, self.board.snapshot())
 
-        self.move_score = 0
-        self.move_length = 0
+    def restore(self, snapshot):
+        """
+        Bring the game back to the state from the snapshot.
+        """
+        self.score = snapshot.score
+        self.moves = snapshot.moves
+        self.board.restore(snapshot.board)
 
-        self.move_next_field(field)
+    def merge(self, other):
+        """
+        Take over the state of a copy of the game, see Board.merge.
+        """
+        self.score = other.score
+        self.moves = other.moves
+        self.move_score = other.move_score
+        self.move_length = other.move_length
+        self.board.merge(other.board)
+
+    def start_move(self, x, y):
+        """
+        Run chain reaction from the given field and finish the move.
+        """
+        self.moves -= 1
+        self.move_score, self.move_length = self.board.chain_reaction(x, y)
+        self.finish_move()
 
     def skip_move(self):
         """
@@ -23,19 +65,42 @@ class Game(object):
         """
         self.moves -= 1
 
-    def move_next_field(self, start_field):
+    def evaluate_moves(self):
         """
-        One step in chain reaction.
+        Returns outcome of every possible move, row by row: points scored,
+        chain length, extra moves gained and snapshot of the board after the
+        move. The game itself is left unchanged.
+
+        With NumPy all moves are made at once on copies of the game, see
+        batch.start_moves, otherwise one by one on a single copy.
         """
-        next_field = self.board.get_next_field(start_field)
-        start_field.direction = None
-        self.move_score += start_field.points
-        self.move_length += 1
+        size = self.board.size
+        moves = [(x, y) for y in range(size) for x in range(size)]
 
-        if next_field is None:
-            self.finish_move()
+        if batch.can_batch([self]):
+            games = [copy.copy(self) for _ in moves]
+            batch.start_moves(games, moves)
         else:
-            self.move_next_field(next_field)
+            games = None
+            game = copy.copy(self)
+            snapshot = game.snapshot()
+
+        evaluations = []
+        for index, (x, y) in enumerate(moves):
+            if games is None:
+                game.restore(snapshot)
+                game.start_move(x, y)
+            else:
+                game = games[index]
+            evaluations.append(MoveEvaluation(
+                x, y,
+                game.score - self.score,
+                game.move_length,
+                game.moves - self.moves + 1,
+                game.board.snapshot(),
+            ))
+
+        return evaluations
 
     def update_score(self):
         """
@@ -59,16 +124,46 @@ class Game(object):
 
         self.update_score()
 
-    def get_state(self, board=True):
+    def get_state(self, board=True, since=None):
         """
-        Get the status of the game.
+        Get the status of the game. When the version of the board known by
+        the client is given, only fields changed since then are returned.
         """
-        return {
+        state = {
             'score': self.score,
             'moves': self.moves,
-            'board': self.board.get_state() if board else None,
+            'version': self.board.get_version(),
+            'board': None,
         }
 
+        if board:
+            changes = None
+            if since is not None:
+                changes = self.board.get_changes(since)
+
+            if changes is None:
+                state['board'] = self.board.get_state()
+            else:
+                state['changes'] = changes
+
+        return state
+
+    def pack_state(self, board=True):
+        """
+        Get the status of the game packed into bytes: header (score, moves,
+        board version, board size) followed by packed board, see Board.pack.
+        Board size is 0 when the board is not included.
+        """
+        header = STATE_HEADER.pack(
+            self.score,
+            self.moves,
+            self.board.get_version(),
+            self.board.size if board else 0,
+        )
+        if not board:
+            return header
+        return header + self.board.pack()
+
     def is_active(self):
         """
         Return whether the game is still active or not.
@@ -0,0 +1,68 @@
+import random
+import threading
+
+from .field import POINTS, DIRECTIONS
+
+# same length as DIRECTIONS, so drawing a code uses the same random numbers
+RANDOM_CODES = list(range(1, len(DIRECTIONS) + 1))
+
+
+class Tape(object):
+    """
+    Sequence of random fields (points and direction codes) for a seed,
+    generated lazily. Boards built on the same tape draw the same fields in
+    the same order, so one tape can be shared by every player of a room.
+    """
+    CHUNK_SIZE = 64
+
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.points = bytearray()
+        self.directions = bytearray()
+        self._initial = {}
+        # boards may read the tape from worker threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.points)
+
+    def extend(self, length):
+        """
+        Generate fields until the tape is at least of the given length.
+        """
+        choice = self.random.choice
+        points = self.points
+        directions = self.directions
+
+        with self._lock:
+            if len(points) >= length:
+                return
+            for _ in range(max(length - len(points), self.CHUNK_SIZE)):
+                points.append(choice(POINTS))
+                directions.append(choice(RANDOM_CODES))
+
+    def get_initial(self, size):
+        """
+        Returns points and directions of a new board of the given size, row
+        by row. The board is filled column by column from the beginning of
+        the tape.
+        """
+        try:
+            return self._initial[size]
+        except KeyError:
+            pass
+
+        count = size * size
+        if len(self) < count:
+            self.extend(count)
+
+        points = bytearray(count)
+        directions = bytearray(count)
+        for position in range(count):
+            x, y = divmod(position, size)
+            points[y * size + x] = self.points[position]
+            directions[y * size + x] = self.directions[position]
+
+        self._initial[size] = bytes(points), bytes(directions)
+        return self._initial[size]
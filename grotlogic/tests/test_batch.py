@@ -0,0 +1,47 @@
+import copy
+import random
+from unittest import TestCase, skipIf
+
+from .. import batch
+from ..board import Board
+from ..game import Game
+from ..tape import Tape
+
+
+class BatchTestCase(TestCase):
+
+    def setUp(self):
+        self.tape = Tape(0)
+        self.games = [Game(Board(5, tape=self.tape)) for _ in range(10)]
+
+    def assert_same_moves(self, games, rounds):
+        expected = [copy.copy(game) for game in games]
+        for round_moves in rounds:
+            versions = [game.get_state()['version'] for game in games]
+            for game, (x, y) in zip(expected, round_moves):
+                game.start_move(x, y)
+            batch.start_moves(games, round_moves)
+
+            for game, other, version in zip(games, expected, versions):
+                self.assertEqual(game.score, other.score)
+                self.assertEqual(game.moves, other.moves)
+                self.assertEqual(
+                    game.get_state()['board'], other.get_state()['board']
+                )
+                self.assertEqual(game.board.position, other.board.position)
+                self.assertIsNotNone(game.board.get_changes(version))
+
+    @skipIf(batch.numpy is None, 'NumPy is not installed.')
+    def test_start_moves(self):
+        self.assertTrue(batch.can_batch(self.games))
+
+        rand = random.Random(0)
+        self.assert_same_moves(self.games, [
+            [(rand.randrange(5), rand.randrange(5)) for _ in self.games]
+            for _ in range(10)
+        ])
+
+    def test_start_moves_one_by_one(self):
+        games = [Game(Board(5, 0)), Game(Board(5, 1))]
+        self.assertFalse(batch.can_batch(games))
+        self.assert_same_moves(games, [[(0, 0), (4, 4)], [(2, 2), (1, 3)]])
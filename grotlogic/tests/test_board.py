@@ -1,3 +1,4 @@
+import copy
 from unittest import TestCase
 
 from ..board import Board
@@ -185,3 +186,154 @@ class BoardTestCase(TestCase):
                 ],
             ],
         )
+
+    def test_fields_are_stored_in_arrays(self):
+        field = self.board.get_field(3, 1)
+        field.points = 4
+        field.direction = 'left'
+
+        index = 1 * self.board.size + 3
+        self.assertEqual(self.board.points[index], 4)
+        self.assertEqual(self.board.get_field(3, 1).direction, 'left')
+
+        field.direction = None
+        self.assertEqual(self.board.directions[index], 0)
+        self.assertIsNone(self.board.get_field(3, 1).direction)
+
+    def test_get_next_field_after_refill(self):
+        set_fields_directions(self.board, '>OOO<', end=1)
+
+        next_field = self.board.get_next_field(self.board.get_field(0, 0))
+        self.assertEqual((next_field.x, next_field.y), (4, 0))
+
+        # skip pointers from the previous lookup must not hide new fields
+        self.board.get_field(2, 0).direction = 'up'
+        next_field = self.board.get_next_field(self.board.get_field(0, 0))
+        self.assertEqual((next_field.x, next_field.y), (2, 0))
+
+    def test_line_counters(self):
+        set_fields_directions(
+            self.board,
+            '''
+            >vvOO
+            >>OOO
+            >OO>O
+            v^>OO
+            <OvOO
+            '''
+        )
+        self.assertEqual(list(self.board.row_counts), [3, 2, 2, 3, 2])
+        self.assertEqual(list(self.board.column_counts), [5, 3, 3, 1, 0])
+        self.assertEqual(self.board.empty_lines, 1)
+
+        self.board.lower_fields()
+        self.assertEqual(list(self.board.row_counts), [1, 1, 3, 3, 4])
+        self.assertEqual(list(self.board.column_counts), [5, 3, 3, 1, 0])
+
+        self.board.fill_empty_fields()
+        self.assertEqual(list(self.board.row_counts), [5] * 5)
+        self.assertEqual(list(self.board.column_counts), [5] * 5)
+        self.assertEqual(self.board.empty_lines, 0)
+
+    def test_fill_empty_fields_uses_random_in_board_order(self):
+        board = Board(5, 1)
+        expected = Board(5, 1)
+        for x, y in [(3, 0), (0, 2), (3, 1), (1, 0)]:
+            board.get_field(x, y).direction = None
+            expected.get_field(x, y).direction = None
+
+        board.fill_empty_fields()
+        self.assertEqual(board.dirty_columns, set())
+
+        # the same fields drawn by scanning whole board column by column
+        for x in range(5):
+            for y in range(5):
+                field = expected.get_field(x, y)
+                if field.direction is None:
+                    field.reset()
+
+        self.assertEqual(board.get_state(), expected.get_state())
+
+    def test_snapshot_and_restore(self):
+        state = self.board.get_state()
+        snapshot = self.board.snapshot()
+
+        self.board.chain_reaction(2, 2)
+        self.board.lower_fields()
+        self.board.fill_empty_fields()
+        changed = self.board.get_state()
+        self.assertNotEqual(state, changed)
+
+        self.board.restore(snapshot)
+        self.assertEqual(self.board.get_state(), state)
+        self.assertEqual(self.board.empty_lines, 0)
+
+        # the same fields are drawn again after restore
+        self.board.chain_reaction(2, 2)
+        self.board.lower_fields()
+        self.board.fill_empty_fields()
+        self.assertEqual(self.board.get_state(), changed)
+
+    def test_copy(self):
+        board = copy.copy(self.board)
+        self.assertEqual(board.get_state(), self.board.get_state())
+
+        board.get_field(0, 0).direction = None
+        self.assertIsNone(board.get_field(0, 0).direction)
+        self.assertIsNotNone(self.board.get_field(0, 0).direction)
+
+    def test_get_changes(self):
+        version = self.board.get_version()
+        self.assertEqual(self.board.get_changes(version), [])
+
+        self.board.get_field(1, 2).direction = 'up'
+        self.board.get_field(4, 0).points = 3
+        changes = self.board.get_changes(version)
+        self.assertEqual(self.board.get_version(), version + 1)
+        self.assertEqual(changes, [
+            self.board.get_field(4, 0).get_state(),
+            self.board.get_field(1, 2).get_state(),
+        ])
+
+        for _ in range(Board.HISTORY_SIZE):
+            self.board.get_field(0, 0).points = 2
+            self.board.get_version()
+
+        # too old version
+        self.assertIsNone(self.board.get_changes(version))
+        self.assertEqual(
+            self.board.get_changes(self.board.version - 1),
+            [self.board.get_field(0, 0).get_state()],
+        )
+        # unknown version
+        self.assertIsNone(self.board.get_changes(self.board.version + 1))
+
+    def test_get_changes_after_move(self):
+        version = self.board.get_version()
+        state = self.board.get_state()
+
+        self.board.chain_reaction(2, 2)
+        self.board.lower_fields()
+        self.board.fill_empty_fields()
+
+        for change in self.board.get_changes(version):
+            state[change['y']][change['x']] = change
+        self.assertEqual(state, self.board.get_state())
+
+    def test_pack(self):
+        set_fields_directions(self.board, '>vO^<', end=1)
+        self.board.get_field(1, 0).points = 4
+
+        packed = self.board.pack()
+        self.assertEqual(len(packed), 25)
+        self.assertEqual(packed[:5], bytes([0x31, 0x24, 0x01, 0x11, 0x41]))
+        for y in range(1, 5):
+            for x in range(5):
+                field = self.board.get_field(x, y)
+                self.assertEqual(packed[y * 5 + x] & 0x0f, field.points)
+                self.assertEqual(
+                    packed[y * 5 + x] >> 4,
+                    [None, 'up', 'down', 'right', 'left'].index(
+                        field.direction
+                    ),
+                )
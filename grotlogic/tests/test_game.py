@@ -1,6 +1,9 @@
-from unittest import TestCase
+import copy
+from unittest import TestCase, skipIf
+from unittest.mock import patch
 
-from ..game import Game
+from .. import batch
+from ..game import Game, STATE_HEADER
 from ..board import Board
 from .utils import assert_fields_directions, set_fields_directions
 
@@ -191,3 +194,120 @@ class GameTestCase(TestCase):
             '''
         )
         self.assertEqual(self.game.score, 61)
+
+    def test_long_chain_on_large_board(self):
+        size = 100
+        game = Game(Board(size, 0))
+        for y in range(size):
+            for x in range(size):
+                field = game.board.get_field(x, y)
+                field.points = 1
+                if y % 2 == 0:
+                    field.direction = 'down' if x == size - 1 else 'right'
+                else:
+                    field.direction = 'down' if x == 0 else 'left'
+
+        game.start_move(0, 0)
+
+        self.assertEqual(game.move_length, size * size)
+        # every row and column was cleared
+        self.assertEqual(game.move_score, size * size + 2 * size * size * 10)
+
+    def test_snapshot_and_restore(self):
+        snapshot = self.game.snapshot()
+        state = self.game.get_state()
+
+        self.game.start_move(1, 1)
+        self.game.start_move(3, 4)
+        self.assertNotEqual(self.game.get_state(), state)
+
+        self.game.restore(snapshot)
+        restored = self.game.get_state()
+        self.assertGreater(restored.pop('version'), state.pop('version'))
+        self.assertEqual(restored, state)
+
+    def test_merge(self):
+        version = self.game.get_state()['version']
+        game = copy.copy(self.game)
+        game.start_move(1, 1)
+        self.assertEqual(self.game.get_state()['version'], version)
+
+        self.game.merge(game)
+        expected = Game(Board(5, 0))
+        expected.start_move(1, 1)
+        self.assertEqual(
+            self.game.get_state()['board'], expected.get_state()['board']
+        )
+        self.assertEqual(self.game.score, expected.score)
+        self.assertEqual(self.game.moves, expected.moves)
+
+        changes = self.game.get_state(since=version)['changes']
+        self.assertIn({'x': 1, 'y': 1}, [
+            {'x': change['x'], 'y': change['y']} for change in changes
+        ])
+        self.assertLess(len(changes), 25)
+
+    def test_evaluate_moves(self):
+        state = self.game.get_state()
+        evaluations = self.game.evaluate_moves()
+
+        self.assertEqual(len(evaluations), 25)
+        self.assertEqual(self.game.get_state(), state)
+
+        for evaluation in evaluations:
+            game = Game(Board(5, 0))
+            game.restore(self.game.snapshot())
+            game.start_move(evaluation.x, evaluation.y)
+
+            self.assertEqual(evaluation.score, game.score)
+            self.assertEqual(evaluation.length, game.move_length)
+            self.assertEqual(evaluation.extra_moves, game.moves - 4)
+
+            expected = game.board.get_state()
+            game.board.restore(evaluation.board)
+            self.assertEqual(game.board.get_state(), expected)
+
+    @skipIf(batch.numpy is None, 'NumPy is not installed.')
+    def test_evaluate_moves_one_by_one(self):
+        self.game.start_move(2, 2)
+        evaluations = self.game.evaluate_moves()
+        with patch.object(batch, 'numpy', None):
+            expected = self.game.evaluate_moves()
+
+        board = Board(5, 0)
+        for evaluation, other in zip(evaluations, expected):
+            self.assertEqual(evaluation[:5], other[:5])
+            board.restore(evaluation.board)
+            state = board.get_state()
+            board.restore(other.board)
+            self.assertEqual(state, board.get_state())
+
+    def test_get_state_since_version(self):
+        version = self.game.get_state()['version']
+        self.game.start_move(0, 0)
+
+        state = self.game.get_state(since=version)
+        self.assertIsNone(state['board'])
+        self.assertTrue(state['changes'])
+        self.assertEqual(state['version'], version + 1)
+
+        state = self.game.get_state(since=version + 1)
+        self.assertEqual(state['changes'], [])
+
+        state = self.game.get_state(since=version + 5)
+        self.assertNotIn('changes', state)
+        self.assertEqual(state['board'], self.game.board.get_state())
+
+    def test_pack_state(self):
+        self.game.start_move(0, 0)
+        packed = self.game.pack_state()
+
+        score, moves, version, size = STATE_HEADER.unpack_from(packed)
+        self.assertEqual(score, self.game.score)
+        self.assertEqual(moves, self.game.moves)
+        self.assertEqual(version, self.game.board.version)
+        self.assertEqual(size, 5)
+        self.assertEqual(packed[STATE_HEADER.size:], self.game.board.pack())
+
+        packed = self.game.pack_state(board=False)
+        self.assertEqual(len(packed), STATE_HEADER.size)
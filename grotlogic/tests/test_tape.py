@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+from ..board import Board
+from ..game import Game
+from ..tape import Tape
+
+
+class TapeTestCase(TestCase):
+
+    def setUp(self):
+        self.tape = Tape(0)
+
+    def test_extend(self):
+        self.tape.extend(100)
+        self.assertGreaterEqual(len(self.tape), 100)
+
+        tape = Tape(0)
+        tape.extend(200)
+        length = len(self.tape)
+        self.assertEqual(tape.points[:length], self.tape.points)
+        self.assertEqual(tape.directions[:length], self.tape.directions)
+
+    def test_get_initial(self):
+        initial = self.tape.get_initial(3)
+        self.assertIs(self.tape.get_initial(3), initial)
+        points, directions = initial
+
+        # board is filled column by column
+        self.assertEqual(points[3], self.tape.points[1])
+        self.assertEqual(directions[1], self.tape.directions[3])
+
+    def test_boards_sharing_tape(self):
+        game1 = Game(Board(5, tape=self.tape))
+        game2 = Game(Board(5, tape=self.tape))
+        game3 = Game(Board(5, 0))
+
+        for x, y in [(0, 0), (3, 2), (1, 4)]:
+            game1.start_move(x, y)
+        for x, y in [(0, 0), (3, 2), (1, 4)]:
+            game2.start_move(x, y)
+            game3.start_move(x, y)
+
+        self.assertEqual(game1.get_state(), game2.get_state())
+        self.assertEqual(game1.get_state(), game3.get_state())
@@ -0,0 +1,60 @@
+import bisect
+import itertools
+
+
+class Leaderboard(object):
+    """
+    Players ordered by score and moves (best first), players with equal
+    results keep the order in which they joined. Updated when results of
+    a player change, instead of sorting all players on every read.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._players = []
+        self._entries = {}
+        self._joined = {}
+        self._counter = itertools.count()
+
+    def __iter__(self):
+        return iter(self._players)
+
+    def __len__(self):
+        return len(self._players)
+
+    def clear(self):
+        self.__init__()
+
+    def _remove(self, player_id):
+        key = self._entries.pop(player_id, None)
+        if key is not None:
+            index = bisect.bisect_left(self._keys, key)
+            del self._keys[index]
+            del self._players[index]
+
+    def update(self, player_id, player):
+        """
+        Put the player on the position for the current score and moves.
+        """
+        self._remove(player_id)
+
+        if player_id not in self._joined:
+            self._joined[player_id] = next(self._counter)
+
+        key = (-player.score, -player.moves, self._joined[player_id])
+        index = bisect.bisect_left(self._keys, key)
+        self._keys.insert(index, key)
+        self._players.insert(index, player)
+        self._entries[player_id] = key
+
+    def top(self, count):
+        """
+        Returns the given number of best players.
+        """
+        return self._players[:count]
+
+    def rank(self, player_id):
+        """
+        Returns position of the player, counting from 0.
+        """
+        return bisect.bisect_left(self._keys, self._entries[player_id])
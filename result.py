@@ -1,14 +1,16 @@
+import time
 from datetime import datetime
 
 import pymongo
 import tornado.gen
-from bson.son import SON
 
 import settings
 
 
 class Result(object):
     collection = settings.db['results']
+    # board size -> (expiration time, best results)
+    _best = {}
 
     def __init__(self, **kwargs):
         self._id = kwargs.get('_id')
@@ -24,41 +26,85 @@ class Result(object):
     @classmethod
     @tornado.gen.coroutine
     def get_best(cls, board_size):
-        cursor = Result.collection.aggregate(
-            [
-                {'$match': {'board_size': board_size}},
-                {
-                    '$group': {
-                        '_id': '$login',
-                        'score': {'$max': '$score'},
-                    }
-                },
-                {"$sort": SON([("score", -1), ("_id", -1)])}
-            ],
-            cursor={}
+        """
+        Best result of every login, served from memory until it expires.
+        Results are kept one per login and board size (see submit), so the
+        best ones are read from the top of the index.
+        """
+        expires, results = cls._best.get(board_size, (0, None))
+        if expires > time.monotonic():
+            return results
+
+        cursor = Result.collection.find(
+            {'board_size': board_size},
+            sort=[('score', pymongo.DESCENDING), ('login', pymongo.DESCENDING)]
+        )
+        results = []
+        logins = set()
+        while len(results) < settings.HALL_OF_FAME_SIZE and \
+                (yield cursor.fetch_next):
+            data = cursor.next_object()
+            # results stored before were not merged per login
+            if data['login'] not in logins:
+                logins.add(data['login'])
+                results.append({'_id': data['login'], 'score': data['score']})
+
+        cls._best[board_size] = (
+            time.monotonic() + settings.HALL_OF_FAME_TTL, results
         )
-        results = yield cursor.to_list(length=100)
         return results
 
+    @classmethod
+    def _update_best(cls, board_size, scores):
+        """
+        Put submitted scores into the cached best results.
+        """
+        expires, results = cls._best.get(board_size, (0, None))
+        if results is None:
+            return
+
+        best = {result['_id']: result['score'] for result in results}
+        for login, score in scores.items():
+            best[login] = max(best.get(login, score), score)
+
+        results = [
+            {'_id': login, 'score': score}
+            for score, login in sorted(
+                ((score, login) for login, score in best.items()),
+                reverse=True,
+            )[:settings.HALL_OF_FAME_SIZE]
+        ]
+        cls._best[board_size] = (expires, results)
+
     def __lt__(self, other):
         return self.score > other.score
 
     @classmethod
     @tornado.gen.coroutine
-    def get_last(cls, login, board_size):
-        data = yield Result.collection.find_one(
-            {'login': login, 'board_size': board_size},
-            sort=[('score', pymongo.DESCENDING)]
-        )
-        return cls(**data) if data else None
-
-    @tornado.gen.coroutine
-    def put(self):
-        data = {
-            'login': self.login,
-            'score': self.score,
-            'date': self.date,
-            'board_size': self.board_size,
-        }
-        result = yield Result.collection.save(data)
+    def submit(cls, board_size, scores):
+        """
+        Keep the best score of every login (scores maps login to score),
+        with the date it was reached, in one bulk write. The result of a
+        login is inserted when missing and updated only by a better score,
+        the updates give the same result in any order, so concurrent
+        submissions can not lower a result. The unique index on login and
+        board size (see db_init) keeps one result per login.
+        """
+        date = datetime.now()
+        requests = []
+        for login, score in sorted(scores.items()):
+            result = {'login': login, 'board_size': board_size}
+            requests += [
+                pymongo.UpdateOne(
+                    result,
+                    {'$setOnInsert': {'score': score, 'date': date}},
+                    upsert=True,
+                ),
+                pymongo.UpdateOne(
+                    dict(result, score={'$lt': score}),
+                    {'$set': {'score': score, 'date': date}},
+                ),
+            ]
+        result = yield Result.collection.bulk_write(requests, ordered=False)
+        cls._update_best(board_size, scores)
         return result
@@ -0,0 +1,138 @@
+import heapq
+import itertools
+import logging
+import math
+import time
+
+from collections import namedtuple
+
+from tornado.ioloop import IOLoop
+
+log = logging.getLogger('grot-server')
+
+Timer = namedtuple('Timer', ['room', 'name', 'remaining'])
+
+
+class RoomScheduler(object):
+    """
+    Deadlines of all game rooms on one monotonic clock. When a deadline
+    passes, the room method with the timer's name is called.
+
+    Deadlines are rounded up to whole ticks, so timers of many rooms expire
+    together and the IOLoop is woken at most once per tick, however many
+    rooms wait. Cancelled timers are only marked and dropped when they reach
+    the top of the heap.
+    """
+    TICK = 1
+
+    def __init__(self):
+        self._heap = []
+        # (room, name) -> [deadline, sequence, room, name], room is None
+        # when cancelled
+        self._timers = {}
+        self._counter = itertools.count()
+        # (IOLoop, handle, deadline) of the next tick
+        self._wakeup = None
+
+    def __len__(self):
+        return len(self._timers)
+
+    def now(self):
+        return time.monotonic()
+
+    def schedule(self, room, name, delay):
+        """
+        Call method `name` of the room after `delay` seconds, replacing the
+        timer of the same name.
+        """
+        self.cancel(room, name)
+
+        deadline = math.ceil((self.now() + delay) / self.TICK) * self.TICK
+        entry = [deadline, next(self._counter), room, name]
+        self._timers[(room, name)] = entry
+        heapq.heappush(self._heap, entry)
+        self._wake_up()
+
+    def cancel(self, room, name):
+        """
+        Cancel the timer, returns False if there was none.
+        """
+        entry = self._timers.pop((room, name), None)
+        if entry is None:
+            return False
+
+        entry[2] = None
+        return True
+
+    def cancel_all(self, room):
+        """
+        Cancel all timers of the room.
+        """
+        for timer in self.pending(room):
+            self.cancel(room, timer.name)
+
+    def get_remaining(self, room, name):
+        """
+        Returns seconds left to the deadline or None if there is no timer.
+        """
+        entry = self._timers.get((room, name))
+        if entry is not None:
+            return max(entry[0] - self.now(), 0)
+
+    def get_deadline_timestamp(self, room, name):
+        """
+        Returns UNIX timestamp of the deadline or None if there is no timer.
+        """
+        remaining = self.get_remaining(room, name)
+        if remaining is not None:
+            return time.time() + remaining
+
+    def pending(self, room=None):
+        """
+        Returns pending timers (of the room if given), the nearest first.
+        """
+        now = self.now()
+        return [
+            Timer(entry[2], entry[3], max(entry[0] - now, 0))
+            for entry in sorted(self._timers.values())
+            if room is None or entry[2] is room
+        ]
+
+    def _wake_up(self):
+        """
+        Make sure the IOLoop wakes up for the nearest deadline.
+        """
+        heap = self._heap
+        while heap and heap[0][2] is None:
+            heapq.heappop(heap)
+        if not heap:
+            return
+
+        deadline = heap[0][0]
+        io_loop = IOLoop.current()
+        if self._wakeup is not None:
+            wakeup_loop, handle, wakeup_deadline = self._wakeup
+            if wakeup_loop is io_loop and wakeup_deadline <= deadline:
+                return
+            wakeup_loop.remove_timeout(handle)
+
+        handle = io_loop.call_later(max(deadline - self.now(), 0), self._tick)
+        self._wakeup = (io_loop, handle, deadline)
+
+    def _tick(self):
+        self._wakeup = None
+
+        now = self.now()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            deadline, _, room, name = heapq.heappop(heap)
+            if room is None:
+                continue
+
+            del self._timers[(room, name)]
+            try:
+                getattr(room, name)()
+            except Exception:
+                log.exception('Timer %s of room %s failed.', name, room)
+
+        self._wake_up()
@@ -3,14 +3,19 @@ import http.client
 import json
 import logging
 import math
+import sys
 
 import tornado.escape
 import tornado.gen
 import tornado.ioloop
+import tornado.iostream
 import tornado.options
+import tornado.process
 import tornado.web
+import tornado.websocket
 
 import settings
+import sharding
 from game_room import GameRoom, DevGameRoom, RoomIsFullException
 from user import User
 from result import Result
@@ -73,26 +78,151 @@ def game_room(handler):
     return wrapper
 
 
+def join_game(game_room, user, alias):
+    """
+    Add user to the game, allowed only before the game starts.
+    """
+    if game_room.started and not isinstance(game_room, DevGameRoom):
+        raise tornado.web.HTTPError(http.client.FORBIDDEN.value)
+    try:
+        return game_room.add_player(user, alias)
+    except RoomIsFullException:
+        raise tornado.web.HTTPError(http.client.FORBIDDEN.value)
+
+
+@tornado.gen.coroutine
+def wait_for_start(game_room, player):
+    while not game_room.started:
+        if player.inactive:
+            # if player was replaced by another client, close connection
+            raise tornado.web.HTTPError(http.client.BAD_REQUEST.value)
+        yield game_room.on_change.wait()
+
+
+def parse_move(game_room, player, data):
+    """
+    Validate move data, returns coordinates of the move.
+    """
+    if not game_room.started or game_room.ended or not player.is_active():
+        raise tornado.web.HTTPError(http.client.METHOD_NOT_ALLOWED.value)
+
+    try:
+        x = int(data['x'])
+        y = int(data['y'])
+    except (
+        KeyError,
+        TypeError,
+        ValueError,
+    ):
+        raise tornado.web.HTTPError(http.client.BAD_REQUEST.value)
+
+    if not 0 <= x < player.board.size or not 0 <= y < player.board.size:
+        raise tornado.web.HTTPError(http.client.BAD_REQUEST.value)
+
+    return x, y
+
+
+@tornado.gen.coroutine
+def make_move(game_room, player, x, y):
+    """
+    Make the move, wait for the next round if player already moved in this
+    one or the move is still computed.
+    """
+    while player.ready.is_set() or player.moving:
+        yield game_room.on_progress.wait()
+        if not player.is_active():
+            return
+
+    try:
+        yield player.compute_move(x, y)
+    except Exception as e:
+        logging.getLogger('tornado.application').exception(e)
+
+
 class BaseHandler(tornado.web.RequestHandler):
+    PACKED_TYPE = 'application/octet-stream'
+    EVENTS_TYPE = 'text/event-stream'
+
+    @property
+    def packed(self):
+        """
+        Whether client asked for packed board state.
+        """
+        return (
+            self.PACKED_TYPE in self.request.headers.get('Accept', '') or
+            self.get_query_argument('packed', None) is not None
+        )
+
+    @property
+    def event_stream(self):
+        """
+        Whether client asked for Server-Sent Events.
+        """
+        return self.EVENTS_TYPE in self.request.headers.get('Accept', '')
+
+    @tornado.gen.coroutine
+    def send_event(self, body, event_id=None):
+        """
+        Send one Server-Sent Event with JSON data. Returns False when the
+        client is gone.
+        """
+        if not self._headers_written:
+            self.set_header('Content-Type', self.EVENTS_TYPE)
+            self.set_header('Cache-Control', 'no-cache')
+
+        if event_id is not None:
+            self.write('id: {}\n'.format(event_id))
+        self.write(b'data: ' + body + b'\n\n')
+
+        try:
+            yield self.flush()
+        except tornado.iostream.StreamClosedError:
+            return False
+        return True
+
+    def write_encoded(self, encoded):
+        """
+        Write response encoded in advance, see game_room.encode.
+        """
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.set_header('Etag', encoded.etag)
+        self.write(encoded.body)
+
+    def write_state(self, player, board=True, since=None):
+        """
+        Write player state as JSON or packed into bytes, set its ETag.
+        """
+        if self.packed:
+            self.set_header('Content-Type', self.PACKED_TYPE)
+            self.write(player.pack_state(board))
+            self.set_etag_header()
+        elif since is None:
+            self.write_encoded(player.get_encoded_state(board))
+        else:
+            self.write(player.get_state(board, since))
+            self.set_etag_header()
+
+    def get_since(self, data=None):
+        """
+        Board version known by the client (from move data or query).
+        """
+        since = data.get('since') if data else None
+        if since is None:
+            since = self.get_query_argument('since', None)
+        if since is None:
+            return None
+
+        try:
+            return int(since)
+        except (TypeError, ValueError):
+            raise tornado.web.HTTPError(http.client.BAD_REQUEST.value)
 
     @tornado.gen.coroutine
     def prepare(self):
         """
         Search for token in GET, POST or cookie. Get User object by token.
         """
-        token = self.get_query_argument('token', None)
-        if not token:
-            token = self.get_secure_cookie('token')
-            if token:
-                token = str(token, 'ascii')
-        if not token and self.request.method == 'POST':
-            try:
-                data = json.loads(self.request.body.decode())
-                token = data['token']
-            except (ValueError, KeyError):
-                pass
-
-        self.current_user = yield User.get(token)
+        self.current_user = yield User.get(sharding.get_token(self))
 
 
 class IndexHandler(BaseHandler):
@@ -159,9 +289,15 @@ class GamesHandler(BaseHandler):
                 current_page=current_page,
             )
 
-        self.write({
+        games = {
             'games': list(game_rooms.keys())
-        })
+        }
+        if self.get_query_argument('details', None) is not None:
+            games['rooms'] = [
+                game_room.get_summary()
+                for game_room in sorted(game_rooms.values())
+            ]
+        self.write(games)
 
     @tornado.gen.coroutine
     @user
@@ -236,8 +372,12 @@ class GamesHandler(BaseHandler):
                 'Title already in use. Use unique title.'
             )
 
+        shard = self.settings['shard']
+        room_id = sharding.new_room_id(*shard) if shard else None
+
         game_room = GameRoom(board_size, title, max_players, auto_start,
-                             auto_restart, with_bot, allow_multi, author)
+                             auto_restart, with_bot, allow_multi, author,
+                             _id=room_id)
         yield game_room.put()
         game_rooms[game_room.room_id] = game_room
         self.write({'room_id': game_room.room_id})
@@ -263,20 +403,15 @@ class GameHandler(BaseHandler):
             return
 
         while True:
-            self.write({
-                'started': game_room.started,
-                'ended': game_room.ended,
-                'start_in': game_room.get_deadline('_auto_start'),
-                'restart_in': game_room.get_deadline('_auto_restart'),
-            })
-            self.set_etag_header()
+            self.write(game_room.get_status())
+            self.set_header('Etag', game_room.get_status_etag())
 
             if not self.check_etag_header():
                 break
 
             self.clear()
 
-            yield tornado.gen.sleep(1)
+            yield game_room.on_status.wait()
 
     @game_room
     @room_owner
@@ -316,29 +451,42 @@ class GameBoardHandler(BaseHandler):
     def get(self, game_room):
         """
         Join the game, wait for start. Returns first board state.
+
+        In the development room `hints` flag returns outcome of every
+        possible move instead.
         """
         alias = self.get_query_argument('alias', '')
-        if game_room.started and not isinstance(game_room, DevGameRoom):
-            raise tornado.web.HTTPError(http.client.FORBIDDEN.value)
-        try:
-            player = game_room.add_player(self.current_user, alias)
-        except RoomIsFullException:
-            raise tornado.web.HTTPError(http.client.FORBIDDEN.value)
+        if self.get_query_argument('hints', None) is not None:
+            if not isinstance(game_room, DevGameRoom):
+                raise tornado.web.HTTPError(http.client.FORBIDDEN.value)
 
-        while not game_room.started:
-            if player.inactive:
-                # if player was replaced by another client, close connection
-                raise tornado.web.HTTPError(http.client.BAD_REQUEST.value)
-            yield game_room.on_change.wait()
+            player = game_room.get_player(self.current_user, alias)
+            self.write({
+                'hints': [
+                    {
+                        'x': evaluation.x,
+                        'y': evaluation.y,
+                        'score': evaluation.score,
+                        'length': evaluation.length,
+                        'extra_moves': evaluation.extra_moves,
+                    }
+                    for evaluation in player.evaluate_moves()
+                ],
+            })
+            return
 
-        self.write(player.get_state())
+        player = join_game(game_room, self.current_user, alias)
+        yield wait_for_start(game_room, player)
+
+        self.write_state(player)
 
     @tornado.gen.coroutine
     @user
     @game_room
     def post(self, game_room):
         """
-        Make a move on board. Returns board state after move.
+        Make a move on board. Returns board state after move, only changed
+        fields when `since` board version is given.
         """
         alias = self.get_query_argument('alias', '')
         try:
@@ -346,33 +494,82 @@ class GameBoardHandler(BaseHandler):
         except LookupError:
             raise tornado.web.HTTPError(http.client.FORBIDDEN.value)
 
-        if not game_room.started or game_room.ended or not player.is_active():
-            raise tornado.web.HTTPError(http.client.METHOD_NOT_ALLOWED.value)
-
         try:
             data = json.loads(self.request.body.decode())
+        except ValueError:
+            data = None
 
-            x = int(data['x'])
-            y = int(data['y'])
-        except (
-            KeyError,
-            TypeError,
-            ValueError,
-        ):
-            raise tornado.web.HTTPError(http.client.BAD_REQUEST.value)
+        x, y = parse_move(game_room, player, data)
+        since = self.get_since(data)
 
-        if not 0 <= x < player.board.size or not 0 <= y < player.board.size:
-            raise tornado.web.HTTPError(http.client.BAD_REQUEST.value)
+        yield make_move(game_room, player, x, y)
+
+        self.write_state(player, since=since)
+
+
+class GameSocketHandler(BaseHandler, tornado.websocket.WebSocketHandler):
+    """
+    Join game and make moves over one WebSocket connection.
+
+    Board state is sent when the game starts and after every move. Moves are
+    sent as JSON messages with `x`, `y` and optional `since`, errors are
+    answered with `error` (HTTP status code) and `reason`.
+    """
 
-        if player.ready.is_set():
-            yield game_room.on_progress.wait()
+    @user
+    @game_room
+    def get(self, game_room):
+        """
+        Join the game and open the connection.
+        """
+        # the player takes a place in the room, so the handshake is checked
+        # before joining, not only by WebSocketHandler.get
+        sharding.check_handshake(self)
 
+        self.game_room = game_room
+        self.player = join_game(
+            game_room, self.current_user, self.get_query_argument('alias', '')
+        )
+        return super(GameSocketHandler, self).get()
+
+    @tornado.gen.coroutine
+    def open(self):
         try:
-            player.start_move(x, y)
-        except Exception as e:
-            logging.getLogger('tornado.application').exception(e)
+            yield wait_for_start(self.game_room, self.player)
+        except tornado.web.HTTPError:
+            self.close(reason='Player was replaced by another client.')
+            return
 
-        self.write(player.get_state())
+        self.send_state()
+
+    @tornado.gen.coroutine
+    def on_message(self, message):
+        try:
+            try:
+                data = json.loads(message)
+            except ValueError:
+                data = None
+
+            x, y = parse_move(self.game_room, self.player, data)
+            since = self.get_since(data)
+        except tornado.web.HTTPError as e:
+            self.write_message({
+                'error': e.status_code,
+                'reason': http.client.responses[e.status_code],
+            })
+            return
+
+        yield make_move(self.game_room, self.player, x, y)
+
+        self.send_state(since)
+
+    def send_state(self, since=None):
+        if self.packed:
+            self.write_message(self.player.pack_state(), binary=True)
+        elif since is None:
+            self.write_message(self.player.get_encoded_state().body)
+        else:
+            self.write_message(self.player.get_state(since=since))
 
 
 class GamePlayersHandler(BaseHandler):
@@ -386,15 +583,23 @@ class GamePlayersHandler(BaseHandler):
         """
         Stream list of players.
         """
+        if self.event_stream:
+            while True:
+                # changes made while the event is sent are not waited for
+                version = game_room.version
+                if not (yield self.send_event(
+                    game_room.get_encoded_results().body, version
+                )):
+                    return
+                if game_room.version == version:
+                    yield game_room.on_change.wait()
+
         if 'html' in self.request.headers.get('Accept', 'html'):
             self.render('templates/players.html', game_room=game_room)
             return
 
         while True:
-            self.write({
-                'players': game_room.get_results(),
-            })
-            self.set_etag_header()
+            self.write_encoded(game_room.get_encoded_results())
 
             if not self.check_etag_header():
                 break
@@ -419,6 +624,20 @@ class GameResultsHandler(BaseHandler):
         """
         Wait for game end and return results.
         """
+        if self.event_stream:
+            sent_results = None
+            while True:
+                # wait for the end of the game, then of the next one; a game
+                # ending while the event is sent is not waited for
+                if not game_room.ended or game_room.results is sent_results:
+                    yield game_room.on_end.wait()
+                    continue
+                sent_results = game_room.results
+                if not (yield self.send_event(
+                    game_room.get_encoded_results().body
+                )):
+                    return
+
         if not game_room.ended:
             yield game_room.on_end.wait()
 
@@ -426,9 +645,7 @@ class GameResultsHandler(BaseHandler):
             self.render('templates/results.html', game_room=game_room)
             return
 
-        self.write({
-            'players': game_room.get_results(),
-        })
+        self.write_encoded(game_room.get_encoded_results())
 
 
 class GamePlayerHandler(BaseHandler):
@@ -440,16 +657,44 @@ class GamePlayerHandler(BaseHandler):
     @game_room
     def get(self, game_room, user):
         """
-        Stream player board status.
+        Stream player board status, only changed fields when `since` board
+        version is given.
         """
         try:
             player = game_room.get_player(user)
         except LookupError:
             raise tornado.web.HTTPError(http.client.NOT_FOUND.value)
 
+        if self.event_stream:
+            last_event_id = self.request.headers.get('Last-Event-ID')
+            if not player.is_active() and last_event_id == str(player.version):
+                # nothing more will come, stop client from reconnecting
+                self.set_status(http.client.NO_CONTENT.value)
+                return
+
+            while True:
+                # moves and rounds started while the event is sent are not
+                # waited for
+                version = (player.version, game_room.round)
+                if not (yield self.send_event(
+                    player.get_encoded_state(game_room.started).body,
+                    player.version,
+                )):
+                    return
+                if not player.is_active():
+                    return
+
+                if (player.version, game_room.round) != version:
+                    continue
+                if game_room.started and not player.ready.is_set():
+                    yield player.ready.wait()
+                else:
+                    yield game_room.on_progress.wait()
+
+        since = self.get_since()
+
         while True:
-            self.write(player.get_state(game_room.started))
-            self.set_etag_header()
+            self.write_state(player, game_room.started, since)
 
             if not self.check_etag_header():
                 break
@@ -491,6 +736,7 @@ application = tornado.web.Application(
         (r'/games', GamesHandler),
         (r'/games/([0-9a-f]{24})', GameHandler),
         (r'/games/([0-9a-f]{24})/board', GameBoardHandler),
+        (r'/games/([0-9a-f]{24})/ws', GameSocketHandler),
         (r'/games/([0-9a-f]{24})/players/?', GamePlayersHandler),
         (r'/games/([0-9a-f]{24})/players/(\w+)', GamePlayerHandler),
         (r'/games/([0-9a-f]{24})/results/?', GameResultsHandler),
@@ -500,14 +746,51 @@ application = tornado.web.Application(
     debug=settings.DEBUG,
     cookie_secret=settings.COOKIE_SECRET,
     db=settings.db,
+    # (number, count) of the shard served by this worker process
+    shard=None,
 )
 
-if __name__ == '__main__':
-    tornado.options.parse_command_line()
-    log.warn('Starting server http://127.0.0.1:8080')
-    application.listen(8080)
-    tornado.ioloop.IOLoop.instance().add_future(
-        GameRoom.get_all(),
+
+def start_worker(port, shard=None):
+    """
+    Serve game rooms, all of them or only those owned by the shard.
+    """
+    application.settings['shard'] = shard
+    application.listen(port)
+    tornado.ioloop.IOLoop.current().add_future(
+        GameRoom.get_all(shard),
         lambda future: game_rooms.update(future.result())
     )
-    tornado.ioloop.IOLoop.instance().start()
+
+
+if __name__ == '__main__':
+    tornado.options.define('port', default=8080, help='port to listen on')
+    tornado.options.define(
+        'workers', default=0,
+        help='number of worker processes, each owning a shard of game rooms '
+             'behind a dispatcher listening on port (0 runs single process)',
+    )
+    tornado.options.parse_command_line()
+    options = tornado.options.options
+
+    if options.workers and settings.DEBUG:
+        # autoreload of the debug mode does not work with forked processes
+        sys.exit('Running workers requires DEBUG = False in settings.')
+
+    if not options.workers:
+        log.warn('Starting server http://127.0.0.1:%s', options.port)
+        start_worker(options.port)
+    else:
+        # process 0 dispatches requests, others are workers of shards
+        ports = [options.port + 1 + n for n in range(options.workers)]
+        task_id = tornado.process.fork_processes(options.workers + 1)
+        if task_id == 0:
+            log.warn('Starting dispatcher http://127.0.0.1:%s', options.port)
+            sharding.make_application(ports).listen(options.port)
+        else:
+            shard = task_id - 1
+            log.warn('Starting shard %s worker on port %s',
+                     shard, ports[shard])
+            start_worker(ports[shard], (shard, options.workers))
+
+    tornado.ioloop.IOLoop.current().start()
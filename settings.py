@@ -13,6 +13,11 @@ ADMINS = (
 
 MIN_HOF_SCORE = 100
 
+# best results kept in memory per board size, reloaded after TTL (seconds)
+# to see results submitted by other processes
+HALL_OF_FAME_SIZE = 100
+HALL_OF_FAME_TTL = 60
+
 COOKIE_SECRET = str(uuid.getnode())
 
 GH_OAUTH_CLIENT_ID = ''
@@ -20,6 +25,23 @@ GH_OAUTH_CLIENT_SECRET = ''
 
 BOT_TOKEN = ''
 
+# signed in users kept in memory by token, other processes see changes of
+# a user after TTL (seconds)
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 60
+
+# threads computing moves outside of the IOLoop, 0 computes them in place
+MOVE_WORKERS = 0
+
+# updates of game rooms are written in batches every interval (seconds) or
+# when batch size is reached, writers wait when too many updates are pending
+ROOM_WRITE_INTERVAL = 1
+ROOM_WRITE_BATCH_SIZE = 100
+ROOM_WRITE_MAX_PENDING = 1000
+
+# make moves of all players together when a round closes (faster with NumPy)
+BATCH_MOVES = False
+
 
 try:
     from local_settings import *
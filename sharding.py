@@ -0,0 +1,331 @@
+import http.client
+import json
+import logging
+import math
+import zlib
+
+from collections import namedtuple
+
+import bson
+import tornado.gen
+import tornado.httpclient
+import tornado.httputil
+import tornado.ioloop
+import tornado.iostream
+import tornado.web
+import tornado.websocket
+
+import settings
+
+log = logging.getLogger('grot-server')
+
+# headers describing a single connection, not forwarded by the dispatcher
+HOP_BY_HOP = frozenset((
+    'Connection',
+    'Keep-Alive',
+    'Proxy-Authenticate',
+    'Proxy-Authorization',
+    'Te',
+    'Trailers',
+    'Transfer-Encoding',
+    'Upgrade',
+    'Content-Length',
+    'Host',
+))
+
+RoomSummary = namedtuple('RoomSummary', 'room_id title author timestamp')
+
+
+def shard_of(key, count):
+    """
+    Number of the shard owning given room id (or any other string key).
+    """
+    return zlib.crc32(key.encode()) % count
+
+
+def new_room_id(shard, count):
+    """
+    Generate ObjectId of a new room owned by given shard.
+    """
+    while True:
+        room_id = bson.ObjectId()
+        if shard_of(str(room_id), count) == shard:
+            return room_id
+
+
+def get_token(handler):
+    """
+    Search for token in GET, POST or cookie.
+    """
+    token = handler.get_query_argument('token', None)
+    if not token:
+        token = handler.get_secure_cookie('token')
+        if token:
+            token = str(token, 'ascii')
+    if not token and handler.request.method == 'POST':
+        try:
+            data = json.loads(handler.request.body.decode())
+            token = data['token']
+        except (ValueError, KeyError, TypeError):
+            pass
+    return token
+
+
+def check_handshake(handler):
+    """
+    Raise HTTPError if the request of the WebSocket handler can not be
+    upgraded.
+    """
+    headers = handler.request.headers
+    connection = [
+        value.strip().lower()
+        for value in headers.get('Connection', '').split(',')
+    ]
+    if headers.get('Upgrade', '').lower() != 'websocket' or \
+            'upgrade' not in connection:
+        raise tornado.web.HTTPError(http.client.BAD_REQUEST.value)
+
+    origin = headers.get('Origin')
+    if origin is not None and not handler.check_origin(origin):
+        raise tornado.web.HTTPError(http.client.FORBIDDEN.value)
+
+
+class ProxyHandler(tornado.web.RequestHandler):
+    """
+    Pass request to the worker owning the room, stream its response back.
+
+    Long polling and event streams are forwarded as they come. When the client
+    goes away the worker connection is dropped with the next chunk.
+    """
+    SUPPORTED_METHODS = ('GET', 'HEAD', 'POST', 'DELETE', 'PUT', 'OPTIONS')
+
+    def initialize(self, ports):
+        self.ports = ports
+        self.closed = False
+        self.upstream_headers = tornado.httputil.HTTPHeaders()
+
+    def get_shard(self, room_id=None):
+        if room_id is None:
+            return 0
+        return shard_of(room_id, len(self.ports))
+
+    def get_url(self, shard, uri=None):
+        return 'http://127.0.0.1:{}{}'.format(
+            self.ports[shard], uri or self.request.uri
+        )
+
+    def on_connection_close(self):
+        self.closed = True
+
+    def _on_header(self, line):
+        if line.startswith('HTTP/'):
+            start_line = tornado.httputil.parse_response_start_line(line)
+            self.set_status(start_line.code, start_line.reason)
+            self.clear_header('Content-Type')
+        elif line.strip():
+            self.upstream_headers.parse_line(line)
+        else:
+            # end of headers
+            for name, value in self.upstream_headers.get_all():
+                if name in HOP_BY_HOP:
+                    continue
+                if name == 'Set-Cookie':
+                    self.add_header(name, value)
+                else:
+                    self.set_header(name, value)
+
+    def _on_chunk(self, chunk):
+        if self.closed:
+            # raising here closes the connection to the worker
+            raise tornado.iostream.StreamClosedError()
+        self.write(chunk)
+        self.flush()
+
+    @tornado.gen.coroutine
+    def proxy(self, shard):
+        headers = tornado.httputil.HTTPHeaders()
+        for name, value in self.request.headers.get_all():
+            if name not in HOP_BY_HOP:
+                headers.add(name, value)
+        headers['X-Forwarded-For'] = self.request.remote_ip
+
+        request = tornado.httpclient.HTTPRequest(
+            self.get_url(shard),
+            method=self.request.method,
+            headers=headers,
+            body=self.request.body if self.request.method in (
+                'POST', 'PUT'
+            ) else None,
+            follow_redirects=False,
+            allow_nonstandard_methods=True,
+            # long polling may take minutes
+            request_timeout=0,
+            header_callback=self._on_header,
+            streaming_callback=self._on_chunk,
+        )
+        try:
+            yield tornado.httpclient.AsyncHTTPClient().fetch(
+                request, raise_error=False
+            )
+        except (OSError, tornado.httpclient.HTTPError) as e:
+            # response codes of the worker are passed through, only
+            # connection errors are raised
+            if self.closed:
+                return
+            log.error('Shard %s is not responding: %s', shard, e)
+            self.clear()
+            raise tornado.web.HTTPError(http.client.BAD_GATEWAY.value)
+
+    @tornado.gen.coroutine
+    def get(self, room_id=None):
+        yield self.proxy(self.get_shard(room_id))
+
+    head = post = delete = put = options = get
+
+
+class GamesProxyHandler(ProxyHandler):
+    """
+    List game rooms of all shards, create new rooms on the shard chosen by
+    user's token, so all rooms of one user live on one shard.
+    """
+    page_size = 20
+
+    @tornado.gen.coroutine
+    def get_rooms(self, shard):
+        """
+        Rooms of one shard, none when the shard is not responding.
+        """
+        try:
+            response = yield tornado.httpclient.AsyncHTTPClient().fetch(
+                self.get_url(shard, '/games?details'),
+                headers={'Accept': 'application/json'},
+            )
+        except (OSError, tornado.httpclient.HTTPError) as e:
+            log.error('Shard %s is not responding: %s', shard, e)
+            return []
+
+        return [
+            RoomSummary(**room)
+            for room in json.loads(response.body.decode())['rooms']
+        ]
+
+    @tornado.gen.coroutine
+    def get(self):
+        # rooms of the shards which answered are listed when some are down
+        shard_rooms = yield [
+            self.get_rooms(shard) for shard in range(len(self.ports))
+        ]
+        rooms = [room for rooms in shard_rooms for room in rooms]
+        rooms.sort(key=lambda room: room.timestamp, reverse=True)
+
+        if 'html' in self.request.headers.get('Accept', 'html'):
+            try:
+                current_page = int(self.get_query_argument('page', '1'))
+            except ValueError:
+                current_page = 1
+            return self.render(
+                'templates/games.html',
+                rooms=rooms[
+                    (current_page-1)*self.page_size:current_page*self.page_size
+                ],
+                total_pages=math.ceil(len(rooms)/self.page_size),
+                current_page=current_page,
+            )
+
+        games = {'games': [room.room_id for room in rooms]}
+        if self.get_query_argument('details', None) is not None:
+            games['rooms'] = [room._asdict() for room in rooms]
+        self.write(games)
+
+    @tornado.gen.coroutine
+    def post(self):
+        token = get_token(self)
+        yield self.proxy(shard_of(token, len(self.ports)) if token else 0)
+
+
+class SocketProxyHandler(tornado.websocket.WebSocketHandler):
+    """
+    Relay WebSocket messages between the client and the worker owning the
+    room.
+    """
+
+    def initialize(self, ports):
+        self.ports = ports
+        self.upstream = None
+
+    @tornado.gen.coroutine
+    def get(self, room_id):
+        # connecting to the worker joins the game, so the handshake of the
+        # client is checked first
+        check_handshake(self)
+
+        shard = shard_of(room_id, len(self.ports))
+        # Origin is checked by the worker against Host of the client
+        headers = {
+            name: self.request.headers[name]
+            for name in ('Cookie', 'Accept', 'Origin', 'Host')
+            if name in self.request.headers
+        }
+        request = tornado.httpclient.HTTPRequest(
+            'ws://127.0.0.1:{}{}'.format(self.ports[shard], self.request.uri),
+            headers=headers,
+        )
+        # connect first, so errors of the worker (e.g. unauthorized user) are
+        # returned to the client as they are
+        try:
+            self.upstream = yield tornado.websocket.websocket_connect(request)
+        except tornado.httpclient.HTTPError as e:
+            raise tornado.web.HTTPError(e.code)
+        except (OSError, tornado.iostream.StreamClosedError) as e:
+            log.error('Shard %s is not responding: %s', shard, e)
+            raise tornado.web.HTTPError(http.client.BAD_GATEWAY.value)
+
+        yield super(SocketProxyHandler, self).get(room_id)
+        if self.ws_connection is None:
+            self.upstream.close()
+
+    def open(self, room_id):
+        tornado.ioloop.IOLoop.current().spawn_callback(self.relay)
+
+    @tornado.gen.coroutine
+    def relay(self):
+        while True:
+            message = yield self.upstream.read_message()
+            if message is None:
+                self.close(self.upstream.close_code,
+                           self.upstream.close_reason)
+                return
+            try:
+                self.write_message(message, binary=isinstance(message, bytes))
+            except tornado.websocket.WebSocketClosedError:
+                self.upstream.close()
+                return
+
+    def on_message(self, message):
+        self.upstream.write_message(message, binary=isinstance(message, bytes))
+
+    def on_close(self):
+        if self.upstream is not None:
+            self.upstream.close()
+
+
+def make_application(ports):
+    """
+    Front application dispatching requests to workers listening on `ports`,
+    worker `n` owns rooms for which `shard_of(room_id, len(ports)) == n`.
+    """
+    AsyncHTTPClient = tornado.httpclient.AsyncHTTPClient
+    # every long polling client holds one connection to a worker
+    AsyncHTTPClient.configure(None, max_clients=10000)
+
+    shards = {'ports': ports}
+    return tornado.web.Application(
+        [
+            (r'/games', GamesProxyHandler, shards),
+            (r'/games/([0-9a-f]{24})/ws', SocketProxyHandler, shards),
+            (r'/games/([0-9a-f]{24})(?:/.*)?', ProxyHandler, shards),
+            (r'/.*', ProxyHandler, shards),
+        ],
+        debug=settings.DEBUG,
+        cookie_secret=settings.COOKIE_SECRET,
+    )
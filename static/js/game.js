@@ -95,7 +95,18 @@ var Game = Backbone.Model.extend({
     if (_.isUndefined(response) || _.isEmpty(response)) {
       return this;
     }
+    // server sends status only when it changes, count down locally
+    this.syncedAt = _.now();
     return response;
+  },
+
+  remaining: function(name) {
+    var value = this.get(name);
+    if (value === null || _.isUndefined(value)) {
+      return null;
+    }
+    var elapsed = Math.floor((_.now() - this.syncedAt) / 1000);
+    return Math.max(value - elapsed, 0);
   }
 });
 _.extend(Game.prototype, Synchronize);
@@ -158,6 +169,7 @@ var ScoreBoard = Backbone.View.extend({
     this.listenTo(this.model.players, 'sort', this.render);
     this.listenTo(this.model.players, 'sync', this.render);
     this.listenTo(this.model, 'sync', this.renderTimer);
+    setInterval(_.bind(this.renderTimer, this), 1000);
 
     this.playerEntryHeight = 50;
     this.columnWidth = 400;
@@ -174,15 +186,18 @@ var ScoreBoard = Backbone.View.extend({
   },
 
   renderTimer: function() {
-    if (this.model.attributes.start_in !== null) {
+    var startIn = this.model.remaining('start_in');
+    var restartIn = this.model.remaining('restart_in');
+
+    if (startIn !== null) {
       this.$el.find('#start_in').show();
-      this.$el.find('#start_in span').text(this.model.attributes.start_in);
+      this.$el.find('#start_in span').text(startIn);
     } else {
       this.$el.find('#start_in').hide();
     }
-    if (this.model.attributes.restart_in !== null) {
+    if (restartIn !== null) {
       this.$el.find('#restart_in').show();
-      this.$el.find('#restart_in span').text(this.model.attributes.restart_in);
+      this.$el.find('#restart_in span').text(restartIn);
     } else {
       this.$el.find('#restart_in').hide();
     }
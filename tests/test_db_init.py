@@ -0,0 +1,90 @@
+import unittest
+import unittest.mock
+
+import tornado.testing
+from tornado.concurrent import Future
+
+import db_init
+
+
+def future_wrap(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class FakeCursor(object):
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    @property
+    def fetch_next(self):
+        return future_wrap(bool(self.documents))
+
+    def next_object(self):
+        return self.documents.pop(0)
+
+
+class HasStageTestCase(unittest.TestCase):
+
+    def test_index_scan(self):
+        plan = {
+            'stage': 'LIMIT',
+            'inputStage': {
+                'stage': 'FETCH',
+                'inputStage': {'stage': 'IXSCAN'},
+            },
+        }
+        self.assertFalse(db_init.has_stage(plan, 'COLLSCAN'))
+        self.assertTrue(db_init.has_stage(plan, 'IXSCAN'))
+
+    def test_collection_scan_in_one_branch(self):
+        plan = {
+            'stage': 'SUBPLAN',
+            'inputStage': {
+                'stage': 'OR',
+                'inputStages': [
+                    {'stage': 'IXSCAN'},
+                    {'stage': 'COLLSCAN'},
+                ],
+            },
+        }
+        self.assertTrue(db_init.has_stage(plan, 'COLLSCAN'))
+
+    def test_slot_based_engine(self):
+        plan = {
+            'queryPlan': {
+                'stage': 'SORT',
+                'inputStage': {'stage': 'COLLSCAN'},
+            },
+            'slotBasedPlan': {'stages': '[1] sort [s4] ...'},
+        }
+        self.assertTrue(db_init.has_stage(plan, 'COLLSCAN'))
+        self.assertFalse(db_init.has_stage(plan, 'IXSCAN'))
+
+
+class RemoveDuplicateResultsTestCase(tornado.testing.AsyncTestCase):
+
+    @unittest.mock.patch('db_init.db')
+    @tornado.testing.gen_test
+    def test_best_results_are_kept(self, db):
+        # sorted by login, board size and score, the best first
+        db.results.find.return_value = FakeCursor([
+            {'_id': 1, 'login': 'a', 'board_size': 5},
+            {'_id': 2, 'login': 'a', 'board_size': 5},
+            {'_id': 3, 'login': 'a', 'board_size': 7},
+            {'_id': 4, 'login': 'b', 'board_size': 5},
+            {'_id': 5, 'login': 'b', 'board_size': 5},
+            {'_id': 6, 'login': 'b', 'board_size': 5},
+        ])
+        db.results.remove.return_value = future_wrap(None)
+
+        yield db_init.remove_duplicate_results()
+        db.results.remove.assert_called_once_with(
+            {'_id': {'$in': [2, 5, 6]}}
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
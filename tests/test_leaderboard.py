@@ -0,0 +1,55 @@
+import unittest
+
+from leaderboard import Leaderboard
+
+
+class FakePlayer(object):
+
+    def __init__(self, score, moves):
+        self.score = score
+        self.moves = moves
+
+
+class LeaderboardTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.leaderboard = Leaderboard()
+        self.players = {
+            'a': FakePlayer(0, 5),
+            'b': FakePlayer(0, 5),
+            'c': FakePlayer(0, 5),
+        }
+        for player_id, player in sorted(self.players.items()):
+            self.leaderboard.update(player_id, player)
+
+    def test_keeps_join_order_for_equal_results(self):
+        self.assertEqual(
+            list(self.leaderboard),
+            [self.players['a'], self.players['b'], self.players['c']],
+        )
+
+    def test_update(self):
+        self.players['c'].score = 10
+        self.leaderboard.update('c', self.players['c'])
+        self.players['b'].moves = 4
+        self.leaderboard.update('b', self.players['b'])
+
+        self.assertEqual(
+            list(self.leaderboard),
+            [self.players['c'], self.players['a'], self.players['b']],
+        )
+        self.assertEqual(self.leaderboard.top(1), [self.players['c']])
+        self.assertEqual(self.leaderboard.rank('a'), 1)
+        self.assertEqual(self.leaderboard.rank('b'), 2)
+        self.assertEqual(len(self.leaderboard), 3)
+
+    def test_replace_player(self):
+        player = FakePlayer(0, 5)
+        self.leaderboard.update('a', player)
+
+        self.assertEqual(len(self.leaderboard), 3)
+        self.assertEqual(self.leaderboard.top(1), [player])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest.mock
+
+import tornado.gen
+import tornado.testing
+
+from scheduler import RoomScheduler
+
+
+class FakeRoom(object):
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def _auto_start(self):
+        self.calls.append((self, '_auto_start'))
+
+    def _end_round(self):
+        self.calls.append((self, '_end_round'))
+
+
+class RoomSchedulerTestCase(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        super(RoomSchedulerTestCase, self).setUp()
+        self.scheduler = RoomScheduler()
+        self.scheduler.TICK = 0.05
+        self.calls = []
+        self.room1 = FakeRoom(self.calls)
+        self.room2 = FakeRoom(self.calls)
+
+    @tornado.testing.gen_test
+    def test_timers_fire_in_order(self):
+        self.scheduler.schedule(self.room1, '_end_round', 0.1)
+        self.scheduler.schedule(self.room2, '_auto_start', 0.01)
+        self.assertEqual(len(self.scheduler), 2)
+
+        yield tornado.gen.sleep(0.3)
+        self.assertEqual(self.calls, [
+            (self.room2, '_auto_start'),
+            (self.room1, '_end_round'),
+        ])
+        self.assertEqual(len(self.scheduler), 0)
+
+    @tornado.testing.gen_test
+    def test_cancel(self):
+        self.scheduler.schedule(self.room1, '_end_round', 0.01)
+        self.scheduler.schedule(self.room2, '_end_round', 0.01)
+        self.assertTrue(self.scheduler.cancel(self.room1, '_end_round'))
+        self.assertFalse(self.scheduler.cancel(self.room1, '_end_round'))
+
+        yield tornado.gen.sleep(0.2)
+        self.assertEqual(self.calls, [(self.room2, '_end_round')])
+
+    def test_ticks_are_coalesced(self):
+        with unittest.mock.patch.object(self.scheduler, 'now') as now:
+            now.return_value = 10.0
+            self.scheduler.schedule(self.room1, '_auto_start', 0.01)
+            now.return_value = 10.02
+            self.scheduler.schedule(self.room2, '_auto_start', 0.01)
+
+            timers = self.scheduler.pending()
+            self.assertEqual(
+                [(timer.room, timer.name) for timer in timers],
+                [(self.room1, '_auto_start'), (self.room2, '_auto_start')],
+            )
+            self.assertEqual(timers[0].remaining, timers[1].remaining)
+            self.assertAlmostEqual(
+                self.scheduler.get_remaining(self.room1, '_auto_start'), 0.03
+            )
+
+    def test_pending_of_room(self):
+        self.scheduler.schedule(self.room1, '_auto_start', 60)
+        self.scheduler.schedule(self.room1, '_end_round', 10)
+        self.scheduler.schedule(self.room2, '_end_round', 5)
+
+        self.assertEqual(
+            [timer.name for timer in self.scheduler.pending(self.room1)],
+            ['_end_round', '_auto_start'],
+        )
+        self.scheduler.cancel_all(self.room1)
+        self.assertEqual(len(self.scheduler), 1)
+        self.assertIsNone(
+            self.scheduler.get_remaining(self.room1, '_auto_start')
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,18 +1,28 @@
+import concurrent.futures
+import copy
 import datetime
 import importlib
 import json
+import struct
 import unittest
 import unittest.mock
 
+import tornado.gen
+import tornado.httpserver
 import tornado.testing
+import tornado.websocket
 from tornado.concurrent import Future
 from tornado.httpclient import AsyncHTTPClient
 from xml.etree.ElementTree import fromstring
 from random import randrange
 
-from game_room import GameRoom
+from game_room import GameRoom, DevGameRoom
+from result import Result
+from user import User
+from grotlogic.game import STATE_HEADER
 import server
 import settings
+import sharding
 
 ID = '000000000000000000000001'
 ID_DEV = '000000000000000000000000'
@@ -31,6 +41,7 @@ class GrotTestCase(tornado.testing.AsyncHTTPTestCase):
     def setUp(self):
         super(GrotTestCase, self).setUp()
         self.client = AsyncHTTPClient(self.io_loop)
+        User.cache.clear()
 
     def get_app(self):
         importlib.reload(server)
@@ -263,6 +274,227 @@ class UserTestCase(GrotTestCase):
         self.assertEqual(deleted.code, 200)
         self.assertEqual(len(server.game_rooms), 0)
 
+    @tornado.testing.gen_test
+    def test_player_event_stream(self):
+        game_room = GameRoom(_id=ID, auto_start=None)
+        player = game_room.add_player(FakeUser('1', 'player1'))
+        player.moves = 0
+        server.game_rooms[ID] = game_room
+
+        response = yield self.client.fetch(
+            self.get_url('/games/{}/players/1'.format(ID)),
+            headers={'Accept': 'text/event-stream'},
+        )
+        self.assertEqual(response.headers['Content-Type'], 'text/event-stream')
+
+        body = response.body.decode()
+        self.assertTrue(body.startswith('id: 0\ndata: '))
+        self.assertTrue(body.endswith('\n\n'))
+        state = json.loads(body.split('data: ', 1)[1])
+        self.assertEqual(state['moves'], 0)
+
+        response = yield self.client.fetch(
+            self.get_url('/games/{}/players/1'.format(ID)),
+            headers={'Accept': 'text/event-stream', 'Last-Event-ID': '0'},
+        )
+        self.assertEqual(response.code, 204)
+
+    @tornado.testing.gen_test
+    def test_players_event_stream_changed_while_sending(self):
+        game_room = GameRoom(_id=ID, auto_start=None)
+        server.game_rooms[ID] = game_room
+        sent = []
+
+        @tornado.gen.coroutine
+        def send_event(handler, body, event_id=None):
+            sent.append(event_id)
+            if len(sent) == 1:
+                # the room changes while the first event is flushed
+                game_room.notify_change()
+                return True
+            return False
+
+        with unittest.mock.patch.object(
+            server.BaseHandler, 'send_event', send_event
+        ):
+            yield self.client.fetch(
+                self.get_url('/games/{}/players'.format(ID)),
+                headers={'Accept': 'text/event-stream'},
+            )
+
+        self.assertEqual(sent, [0, 1])
+
+    @unittest.mock.patch(
+        'server.User.collection.find_one',
+        return_value=future_wrap({
+            '_id': ID,
+            'login': LOGIN,
+            'token': TOKEN,
+        })
+    )
+    @tornado.testing.gen_test
+    def test_websocket_game(self, user_get):
+        connection = yield tornado.websocket.websocket_connect(
+            self.get_url('/games/{}/ws?token={}'.format(
+                ID_DEV, TOKEN
+            )).replace('http', 'ws', 1),
+        )
+
+        state = json.loads((yield connection.read_message()))
+        self.assertEqual(state['moved'], None)
+        self.assertEqual(len(state['board']), 5)
+
+        connection.write_message(json.dumps({'x': 1, 'y': 2}))
+        state = json.loads((yield connection.read_message()))
+        self.assertEqual(state['moved'], [1, 2])
+
+        connection.write_message(json.dumps({'x': 1, 'y': 7}))
+        error = json.loads((yield connection.read_message()))
+        self.assertEqual(error['error'], 400)
+
+        connection.write_message(json.dumps({
+            'x': 0, 'y': 0, 'since': state['version'],
+        }))
+        state = json.loads((yield connection.read_message()))
+        self.assertIsNone(state['board'])
+        self.assertTrue(state['changes'])
+
+        connection.close()
+
+    @tornado.testing.gen_test
+    def test_websocket_requires_user(self):
+        with self.assertRaises(tornado.httpclient.HTTPError) as ex:
+            yield tornado.websocket.websocket_connect(
+                self.get_url('/games/{}/ws'.format(
+                    ID_DEV
+                )).replace('http', 'ws', 1),
+            )
+        self.assertEqual(ex.exception.code, 401)
+
+    @unittest.mock.patch(
+        'server.User.collection.find_one',
+        return_value=future_wrap({
+            '_id': ID,
+            'login': LOGIN,
+            'token': TOKEN,
+        })
+    )
+    @tornado.testing.gen_test
+    def test_websocket_without_upgrade(self, user_get):
+        game_room = GameRoom(_id=ID, auto_start=None)
+        server.game_rooms[ID] = game_room
+
+        with self.assertRaises(tornado.httpclient.HTTPError) as ex:
+            yield self.client.fetch(
+                self.get_url('/games/{}/ws?token={}'.format(ID, TOKEN)),
+            )
+        self.assertEqual(ex.exception.code, 400)
+        self.assertEqual(game_room.players, [])
+
+    @unittest.mock.patch(
+        'server.User.collection.find_one',
+        return_value=future_wrap({
+            '_id': ID,
+            'login': LOGIN,
+            'token': TOKEN,
+        })
+    )
+    @tornado.testing.gen_test
+    def test_packed_board(self, user_get):
+        join = yield self.client.fetch(
+            self.get_url('/games/{}/board?token={}'.format(ID_DEV, TOKEN)),
+            method='GET',
+            headers={'Accept': 'application/octet-stream'},
+        )
+        self.assertEqual(
+            join.headers['Content-Type'], 'application/octet-stream'
+        )
+        self.assertEqual(len(join.body), 4 + STATE_HEADER.size + 25)
+
+        x, y, score, moves, version, size = struct.unpack_from(
+            '!hhiiIH', join.body
+        )
+        self.assertEqual((x, y, score, size), (-1, -1, 0, 5))
+
+        move = yield self.client.fetch(
+            self.get_url('/games/{}/board?packed&token={}'.format(
+                ID_DEV, TOKEN
+            )),
+            method='POST',
+            body=json.dumps({'x': 2, 'y': 3}),
+        )
+        x, y = struct.unpack_from('!hh', move.body)
+        self.assertEqual((x, y), (2, 3))
+
+    @unittest.mock.patch(
+        'server.User.collection.find_one',
+        return_value=future_wrap({
+            '_id': ID,
+            'login': LOGIN,
+            'token': TOKEN,
+        })
+    )
+    @tornado.testing.gen_test
+    def test_move_changes_since_version(self, user_get):
+        join = yield self.client.fetch(
+            self.get_url('/games/{}/board?token={}'.format(ID_DEV, TOKEN)),
+            method='GET',
+        )
+        state = json.loads(join.body.decode())
+
+        move = yield self.client.fetch(
+            self.get_url('/games/{}/board?token={}'.format(ID_DEV, TOKEN)),
+            method='POST',
+            body=json.dumps({'x': 2, 'y': 2, 'since': state['version']}),
+        )
+        move = json.loads(move.body.decode())
+
+        self.assertIsNone(move['board'])
+        self.assertGreater(move['version'], state['version'])
+        changed = [(field['x'], field['y']) for field in move['changes']]
+        self.assertIn((2, 2), changed)
+
+    @unittest.mock.patch(
+        'server.game_rooms', {
+            ID: GameRoom(
+                _id=ID,
+                author=LOGIN
+            )
+        }
+    )
+    @unittest.mock.patch(
+        'server.User.collection.find_one',
+        return_value=future_wrap({
+            '_id': ID,
+            'login': LOGIN,
+            'token': TOKEN,
+        })
+    )
+    @tornado.testing.gen_test
+    def test_move_hints(self, user_get):
+        response = yield self.client.fetch(
+            self.get_url('/games/{}/board?hints&token={}'.format(
+                ID_DEV, TOKEN
+            )),
+            method='GET',
+        )
+        hints = json.loads(response.body.decode())['hints']
+
+        self.assertEqual(len(hints), 25)
+        self.assertEqual((hints[7]['x'], hints[7]['y']), (2, 1))
+        for hint in hints:
+            self.assertGreater(hint['length'], 0)
+            self.assertGreaterEqual(hint['score'], hint['length'])
+
+        with self.assertRaises(tornado.httpclient.HTTPError) as ex:
+            yield self.client.fetch(
+                self.get_url('/games/{}/board?hints&token={}'.format(
+                    ID, TOKEN
+                )),
+                method='GET',
+            )
+        self.assertEqual(ex.exception.code, 403)
+
     @unittest.mock.patch(
         'server.game_rooms', {
             ID: GameRoom(
@@ -347,5 +579,489 @@ class UserTestCase(GrotTestCase):
         self.assertEqual(args[0]['gh_token'], access_token)
 
 
+class FakeUser(object):
+
+    def __init__(self, user_id, login):
+        self.id = user_id
+        self.login = login
+
+
+class GameRoomTestCase(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        super(GameRoomTestCase, self).setUp()
+        self.game_room = GameRoom(_id=ID, auto_start=None, auto_restart=None)
+        self.player1 = self.game_room.add_player(FakeUser('1', 'player1'))
+        self.player2 = self.game_room.add_player(FakeUser('2', 'player2'))
+
+    @unittest.mock.patch('game_room.GameRoom.submit_result')
+    @unittest.mock.patch('game_room.GameRoom.put')
+    def test_round_barrier(self, put, submit_result):
+        self.game_room.start()
+        self.assertEqual(self.game_room.round, 1)
+
+        self.player1.start_move(0, 0)
+        self.assertEqual(self.game_room.round, 1)
+        self.assertEqual(list(self.game_room.players_unready), [self.player2])
+
+        self.player2.skip_move()
+        self.assertEqual(self.game_room.round, 2)
+        self.assertFalse(self.player1.ready.is_set())
+
+        self.player2.moves = 1
+        self.player2.skip_move()
+        self.player1.moves = 1
+        self.player1.skip_move()
+        self.assertEqual(self.game_room.round, 2)
+        self.assertTrue(self.game_room.ended)
+        self.assertEqual(
+            [result['login'] for result in self.game_room.results],
+            ['player1', 'player2'],
+        )
+
+    @unittest.mock.patch('game_room.GameRoom.submit_result')
+    @unittest.mock.patch('game_room.GameRoom.put')
+    @tornado.testing.gen_test
+    def test_compute_move_in_executor(self, put, submit_result):
+        executor = concurrent.futures.ThreadPoolExecutor(2)
+        self.addCleanup(executor.shutdown)
+        self.game_room.start()
+        expected = copy.copy(self.player1)
+        expected.start_move(0, 0)
+
+        with unittest.mock.patch('game_room.move_executor', executor):
+            move = self.player1.compute_move(0, 0)
+            self.assertTrue(self.player1.moving)
+            # move sent in time is not skipped at the end of the round
+            self.game_room._end_round()
+            yield move
+
+        self.assertFalse(self.player1.moving)
+        self.assertEqual(self.player1.moved, (0, 0))
+        self.assertEqual(self.player1.score, expected.score)
+        self.assertEqual(
+            self.player1.get_state()['board'], expected.get_state()['board']
+        )
+        self.assertEqual(self.game_room.round, 2)
+
+    @unittest.mock.patch('game_room.GameRoom.submit_result')
+    @unittest.mock.patch('game_room.GameRoom.put')
+    @tornado.testing.gen_test
+    def test_concurrent_moves_in_executor(self, put, submit_result):
+        executor = concurrent.futures.ThreadPoolExecutor(2)
+        self.addCleanup(executor.shutdown)
+        self.game_room.start()
+
+        with unittest.mock.patch('game_room.move_executor', executor):
+            first = server.make_move(self.game_room, self.player1, 0, 0)
+            # the first move is still computed, this one waits for the next
+            # round
+            second = server.make_move(self.game_room, self.player1, 1, 1)
+            yield first
+            # a move queued behind the first one would hold the lock now
+            with (yield self.game_room.move_lock.acquire()):
+                pass
+            self.assertFalse(second.done())
+            self.assertEqual(self.player1.moved, (0, 0))
+
+            self.player2.skip_move()
+            self.assertEqual(self.game_room.round, 2)
+            yield second
+
+        self.assertEqual(self.player1.moved, (1, 1))
+        self.assertEqual(self.game_room.round, 2)
+        self.assertEqual(list(self.game_room.players_unready), [self.player2])
+
+    @unittest.mock.patch('game_room.GameRoom.submit_result')
+    @unittest.mock.patch('game_room.GameRoom.put')
+    @tornado.testing.gen_test
+    def test_batch_moves(self, put, submit_result):
+        self.game_room.batch_moves = True
+        self.game_room.start()
+        expected1 = copy.copy(self.player1)
+        expected1.start_move(0, 0)
+        expected2 = copy.copy(self.player2)
+        expected2.start_move(2, 3)
+
+        move = self.player1.compute_move(0, 0)
+        self.assertFalse(move.done())
+        self.assertFalse(self.player1.ready.is_set())
+
+        yield self.player2.compute_move(2, 3)
+        yield move
+        self.assertEqual(self.game_room.round, 2)
+        self.assertEqual(self.player1.moved, (0, 0))
+        self.assertEqual(self.player1.score, expected1.score)
+        self.assertEqual(self.player2.score, expected2.score)
+        self.assertEqual(
+            self.player2.get_state()['board'], expected2.get_state()['board']
+        )
+
+        # moves sent before the round times out are made with it
+        move = self.player1.compute_move(1, 1)
+        self.game_room._end_round()
+        yield move
+        self.assertEqual(self.game_room.round, 3)
+        self.assertEqual(self.player2.moved, None)
+
+    @unittest.mock.patch('game_room.GameRoom.submit_result')
+    @unittest.mock.patch('game_room.GameRoom.put')
+    @tornado.testing.gen_test
+    def test_batch_moves_round_timeout(self, put, submit_result):
+        self.game_room.batch_moves = True
+        player3 = self.game_room.add_player(FakeUser('3', 'player3'))
+        self.game_room.start()
+
+        # only the last player moved, skipping the others commits the move
+        # and starts the next round in the middle of _end_round
+        move = player3.compute_move(0, 0)
+        self.game_room._end_round()
+        yield move
+
+        self.assertEqual(self.game_room.round, 2)
+        self.assertEqual(player3.moved, (0, 0))
+        self.assertTrue(player3.pending)
+        self.assertFalse(player3.ready.is_set())
+
+    @unittest.mock.patch('game_room.GameRoom.submit_result')
+    @unittest.mock.patch('game_room.GameRoom.put')
+    @tornado.testing.gen_test
+    def test_batch_moves_replace_queued_move(self, put, submit_result):
+        self.game_room.batch_moves = True
+        self.game_room.start()
+        expected = copy.copy(self.player1)
+        expected.start_move(1, 1)
+
+        first = self.player1.compute_move(0, 0)
+        second = self.player1.compute_move(1, 1)
+        self.assertFalse(first.done())
+        self.assertEqual(self.game_room.round, 1)
+
+        yield self.player2.compute_move(2, 3)
+        yield [first, second]
+        self.assertEqual(self.game_room.round, 2)
+        self.assertEqual(self.player1.moved, (1, 1))
+        self.assertEqual(self.player1.moves, expected.moves)
+        self.assertEqual(
+            self.player1.get_state()['board'], expected.get_state()['board']
+        )
+
+    @unittest.mock.patch('grotlogic.batch.numpy', None)
+    @unittest.mock.patch('game_room.GameRoom.submit_result')
+    @unittest.mock.patch('game_room.GameRoom.put')
+    @tornado.testing.gen_test
+    def test_batch_moves_without_numpy(self, put, submit_result):
+        self.game_room.batch_moves = True
+        self.game_room.start()
+        expected1 = copy.copy(self.player1)
+        expected1.start_move(0, 0)
+        expected2 = copy.copy(self.player2)
+        expected2.start_move(2, 3)
+
+        yield [
+            self.player1.compute_move(0, 0),
+            self.player2.compute_move(2, 3),
+        ]
+        self.assertEqual(self.game_room.round, 2)
+        self.assertEqual(self.player1.moves, expected1.moves)
+        self.assertEqual(self.player2.moves, expected2.moves)
+        self.assertEqual(self.player2.score, expected2.score)
+        self.assertEqual(
+            list(self.game_room.players_unready), [self.player1, self.player2]
+        )
+
+    @unittest.mock.patch(
+        'result.Result.collection.bulk_write',
+        return_value=future_wrap(None)
+    )
+    @tornado.testing.gen_test
+    def test_submit_result(self, bulk_write):
+        self.player1.score = settings.MIN_HOF_SCORE + 10
+        self.player2.score = settings.MIN_HOF_SCORE
+
+        yield self.game_room.submit_result()
+
+        args, kwargs = bulk_write.call_args
+        insert, update = args[0]
+        score = settings.MIN_HOF_SCORE + 10
+        self.assertEqual(
+            insert._filter, {'login': 'player1', 'board_size': 5}
+        )
+        self.assertEqual(insert._doc['$setOnInsert']['score'], score)
+        self.assertTrue(insert._upsert)
+
+        # a better score replaces the result together with its date
+        self.assertEqual(update._filter, {
+            'login': 'player1', 'board_size': 5, 'score': {'$lt': score},
+        })
+        self.assertEqual(update._doc['$set']['score'], score)
+        self.assertEqual(
+            update._doc['$set']['date'], insert._doc['$setOnInsert']['date']
+        )
+        self.assertFalse(update._upsert)
+
+    def test_encoded_responses_are_shared(self):
+        results = self.game_room.get_encoded_results()
+        self.assertIs(self.game_room.get_encoded_results(), results)
+        self.assertEqual(
+            json.loads(results.body.decode()),
+            {'players': self.game_room.get_results()},
+        )
+
+        state = self.player1.get_encoded_state()
+        self.assertIs(self.player1.get_encoded_state(), state)
+        self.assertIsNot(self.player1.get_encoded_state(False), state)
+
+        self.game_room.start()
+        self.player1.start_move(0, 0)
+
+        self.assertNotEqual(self.game_room.get_encoded_results(), results)
+        state = json.loads(self.player1.get_encoded_state().body.decode())
+        self.assertEqual(state['score'], self.player1.score)
+        self.assertEqual(state['moved'], [0, 0])
+
+    def test_dev_room_results(self):
+        game_room = DevGameRoom(board_size=5)
+        player = game_room.add_player(FakeUser('1', 'player1'))
+        player.start_move(0, 0)
+
+        self.assertEqual(game_room.get_results(), [])
+        self.assertEqual(
+            json.loads(game_room.get_encoded_results().body.decode()),
+            {'players': []},
+        )
+
+    def test_status_changes(self):
+        etag = self.game_room.get_status_etag()
+        self.assertEqual(self.game_room.get_status_etag(), etag)
+
+        condition = self.game_room.on_status.wait()
+        self.game_room.start()
+
+        self.assertTrue(condition.done())
+        self.assertTrue(self.game_room.get_status()['started'])
+        self.assertNotEqual(self.game_room.get_status_etag(), etag)
+
+
+class FakeCursor(object):
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    @property
+    def fetch_next(self):
+        return future_wrap(bool(self.documents))
+
+    def next_object(self):
+        return self.documents.pop(0)
+
+
+class ResultTestCase(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        super(ResultTestCase, self).setUp()
+        Result._best.clear()
+        self.addCleanup(Result._best.clear)
+
+    @unittest.mock.patch('result.Result.collection.find')
+    @tornado.testing.gen_test
+    def test_best_results_are_cached(self, find):
+        find.return_value = FakeCursor([
+            {'login': 'a', 'score': 300},
+            {'login': 'b', 'score': 200},
+            {'login': 'a', 'score': 150},
+        ])
+
+        results = yield Result.get_best(5)
+        self.assertEqual(results, [
+            {'_id': 'a', 'score': 300},
+            {'_id': 'b', 'score': 200},
+        ])
+        self.assertEqual((yield Result.get_best(5)), results)
+        self.assertEqual(find.call_count, 1)
+
+        with unittest.mock.patch(
+            'result.Result.collection.bulk_write',
+            return_value=future_wrap(None)
+        ):
+            yield Result.submit(5, {'b': 400, 'c': 250, 'a': 100})
+
+        self.assertEqual((yield Result.get_best(5)), [
+            {'_id': 'b', 'score': 400},
+            {'_id': 'a', 'score': 300},
+            {'_id': 'c', 'score': 250},
+        ])
+        self.assertEqual(find.call_count, 1)
+
+
+class ShardingTestCase(unittest.TestCase):
+
+    def test_shard_of(self):
+        shards = {
+            sharding.shard_of('{:024x}'.format(n), 4) for n in range(100)
+        }
+        self.assertEqual(shards, {0, 1, 2, 3})
+        self.assertEqual(sharding.shard_of(ID, 4), sharding.shard_of(ID, 4))
+
+    def test_new_room_id(self):
+        for shard in range(3):
+            room_id = sharding.new_room_id(shard, 3)
+            self.assertEqual(sharding.shard_of(str(room_id), 3), shard)
+
+
+class DispatcherTestCase(tornado.testing.AsyncHTTPTestCase):
+
+    def setUp(self):
+        super(DispatcherTestCase, self).setUp()
+        self.client = AsyncHTTPClient(self.io_loop)
+
+    def get_app(self):
+        importlib.reload(server)
+
+        sock, port = tornado.testing.bind_unused_port()
+        self.worker = tornado.httpserver.HTTPServer(server.application)
+        self.worker.add_sockets([sock])
+
+        self.ports = [port]
+        return sharding.make_application(self.ports)
+
+    def tearDown(self):
+        self.worker.stop()
+        super(DispatcherTestCase, self).tearDown()
+
+    @tornado.testing.gen_test
+    def test_games_list(self):
+        game_room = GameRoom(author=LOGIN, title='sharded', _id=ID)
+        with unittest.mock.patch.dict(server.game_rooms, {ID: game_room}):
+            result = yield self.client.fetch(
+                self.get_url('/games'),
+                headers={'Accept': 'application/json'},
+            )
+            self.assertEqual(json.loads(result.body.decode()), {'games': [ID]})
+
+            result = yield self.client.fetch(self.get_url('/games'))
+            self.assertIn(
+                '<a href="/games/{}">sharded</a>'.format(ID),
+                result.body.decode()
+            )
+
+    @tornado.testing.gen_test
+    def test_games_list_with_shard_down(self):
+        sock, port = tornado.testing.bind_unused_port()
+        sock.close()
+        self.ports.append(port)
+
+        game_room = GameRoom(author=LOGIN, title='sharded', _id=ID)
+        with unittest.mock.patch.dict(server.game_rooms, {ID: game_room}):
+            with self.assertLogs('grot-server', 'ERROR'):
+                result = yield self.client.fetch(
+                    self.get_url('/games'),
+                    headers={'Accept': 'application/json'},
+                )
+        self.assertEqual(json.loads(result.body.decode()), {'games': [ID]})
+
+    @tornado.testing.gen_test
+    def test_room_requests(self):
+        response = yield self.client.fetch(
+            self.get_url('/games/{}'.format(ID_DEV)),
+            headers={'Accept': 'application/json'},
+        )
+        self.assertEqual(response.code, 200)
+        self.assertTrue(response.headers['Etag'])
+        self.assertTrue(json.loads(response.body.decode())['started'])
+
+        response = yield self.client.fetch(
+            self.get_url('/games/{}'.format(ID)), raise_error=False
+        )
+        self.assertEqual(response.code, 404)
+
+    @unittest.mock.patch(
+        'server.User.collection.find_one',
+        return_value=future_wrap({
+            '_id': ID,
+            'login': LOGIN,
+            'token': TOKEN,
+        })
+    )
+    @tornado.testing.gen_test
+    def test_websocket_game(self, user_get):
+        connection = yield tornado.websocket.websocket_connect(
+            self.get_url('/games/{}/ws?token={}'.format(
+                ID_DEV, TOKEN
+            )).replace('http', 'ws', 1),
+        )
+
+        state = json.loads((yield connection.read_message()))
+        self.assertEqual(len(state['board']), 5)
+
+        connection.write_message(json.dumps({'x': 1, 'y': 2}))
+        state = json.loads((yield connection.read_message()))
+        self.assertEqual(state['moved'], [1, 2])
+
+        connection.close()
+
+    @tornado.testing.gen_test
+    def test_websocket_requires_user(self):
+        with self.assertRaises(tornado.httpclient.HTTPError) as ex:
+            yield tornado.websocket.websocket_connect(
+                self.get_url('/games/{}/ws'.format(
+                    ID_DEV
+                )).replace('http', 'ws', 1),
+            )
+        self.assertEqual(ex.exception.code, 401)
+
+    @unittest.mock.patch(
+        'server.User.collection.find_one',
+        return_value=future_wrap({
+            '_id': ID,
+            'login': LOGIN,
+            'token': TOKEN,
+        })
+    )
+    @tornado.testing.gen_test
+    def test_websocket_without_upgrade(self, user_get):
+        game_room = GameRoom(_id=ID, auto_start=None)
+
+        with unittest.mock.patch.dict(server.game_rooms, {ID: game_room}):
+            with self.assertRaises(tornado.httpclient.HTTPError) as ex:
+                yield self.client.fetch(
+                    self.get_url('/games/{}/ws?token={}'.format(ID, TOKEN)),
+                )
+        self.assertEqual(ex.exception.code, 400)
+        self.assertEqual(game_room.players, [])
+
+    @unittest.mock.patch(
+        'server.User.collection.find_one',
+        return_value=future_wrap({
+            '_id': ID,
+            'login': LOGIN,
+            'token': TOKEN,
+        })
+    )
+    @tornado.testing.gen_test
+    def test_websocket_origin(self, user_get):
+        url = self.get_url('/games/{}/ws?token={}'.format(ID_DEV, TOKEN))
+
+        # the worker checks the origin against the host of the client
+        connection = yield tornado.websocket.websocket_connect(
+            tornado.httpclient.HTTPRequest(
+                url.replace('http', 'ws', 1),
+                headers={'Origin': self.get_url('')},
+            )
+        )
+        state = json.loads((yield connection.read_message()))
+        self.assertEqual(len(state['board']), 5)
+        connection.close()
+
+        with self.assertRaises(tornado.httpclient.HTTPError) as ex:
+            yield tornado.websocket.websocket_connect(
+                tornado.httpclient.HTTPRequest(
+                    url.replace('http', 'ws', 1),
+                    headers={'Origin': 'http://example.com'},
+                )
+            )
+        self.assertEqual(ex.exception.code, 403)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import unittest.mock
+
+import tornado.testing
+from tornado.concurrent import Future
+
+from user import User, UserCache
+
+TOKEN = '00000000-0000-0000-0000-000000000000'
+
+
+def future_wrap(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class UserCacheTestCase(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        super(UserCacheTestCase, self).setUp()
+        User.cache.clear()
+        self.addCleanup(User.cache.clear)
+
+    @unittest.mock.patch('user.User.collection.find_one')
+    @tornado.testing.gen_test
+    def test_users_are_cached_by_token(self, find_one):
+        find_one.return_value = future_wrap(
+            {'_id': 1, 'login': 'stxnext', 'token': TOKEN}
+        )
+
+        user = yield User.get(TOKEN)
+        self.assertIs((yield User.get(TOKEN)), user)
+        self.assertEqual(find_one.call_count, 1)
+
+        yield User.get(login='stxnext')
+        self.assertEqual(find_one.call_count, 2)
+
+    @unittest.mock.patch(
+        'user.User.collection.find_one', return_value=future_wrap(None)
+    )
+    @tornado.testing.gen_test
+    def test_unknown_tokens_are_not_cached(self, find_one):
+        self.assertIsNone((yield User.get(TOKEN)))
+        self.assertIsNone((yield User.get(TOKEN)))
+        self.assertEqual(find_one.call_count, 2)
+
+    @unittest.mock.patch('user.User.collection.save')
+    @unittest.mock.patch('user.User.collection.find_one')
+    @tornado.testing.gen_test
+    def test_put_invalidates(self, find_one, save):
+        find_one.return_value = future_wrap(
+            {'_id': 1, 'login': 'stxnext', 'token': TOKEN}
+        )
+        save.return_value = future_wrap(1)
+
+        user = yield User.get(TOKEN)
+        user.token = 'new token'
+        yield user.put()
+
+        self.assertEqual(len(User.cache), 0)
+        yield User.get(TOKEN)
+        self.assertEqual(find_one.call_count, 2)
+
+    def test_expiration_and_size(self):
+        cache = UserCache(max_size=2, ttl=60)
+        users = [User('login{}'.format(n), _id=n) for n in range(3)]
+        for user in users:
+            cache.put(user.token, user)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(users[0].token))
+        self.assertIs(cache.get(users[2].token), users[2])
+
+        cache.ttl = 0
+        cache.put(users[0].token, users[0])
+        self.assertIsNone(cache.get(users[0].token))
+
+
+if __name__ == '__main__':
+    unittest.main()
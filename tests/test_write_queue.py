@@ -0,0 +1,106 @@
+import unittest
+
+import tornado.gen
+import tornado.testing
+from tornado.concurrent import Future
+
+from write_queue import WriteQueue
+
+
+class FakeCollection(object):
+
+    def __init__(self):
+        self.writes = []
+        self.blocked = None
+
+    @tornado.gen.coroutine
+    def bulk_write(self, requests, ordered=True):
+        self.writes.append([
+            (request._filter['_id'], request._doc) for request in requests
+        ])
+        if self.blocked is not None:
+            yield self.blocked
+
+
+class WriteQueueTestCase(tornado.testing.AsyncTestCase):
+
+    def setUp(self):
+        super(WriteQueueTestCase, self).setUp()
+        self.collection = FakeCollection()
+        self.queue = WriteQueue(
+            self.collection, interval=0.01, batch_size=3, max_pending=4
+        )
+
+    @tornado.testing.gen_test
+    def test_updates_are_merged(self):
+        first = self.queue.put(1, {'score': 1})
+        second = self.queue.put(1, {'score': 2})
+        third = self.queue.put(2, {'score': 3})
+        self.assertEqual(len(self.queue), 2)
+
+        yield [first, second, third]
+        self.assertEqual(
+            self.collection.writes, [[(1, {'score': 2}), (2, {'score': 3})]]
+        )
+
+    @tornado.testing.gen_test
+    def test_batch_size(self):
+        self.queue.interval = 60
+        yield [self.queue.put(n, {'n': n}) for n in range(3)]
+        self.assertEqual(len(self.collection.writes), 1)
+
+        # waits for the interval
+        write = self.queue.put(3, {'n': 3})
+        yield tornado.gen.moment
+        self.assertEqual(len(self.queue), 1)
+
+        yield self.queue.flush()
+        yield write
+        self.assertEqual(
+            [len(write) for write in self.collection.writes], [3, 1]
+        )
+
+    @tornado.testing.gen_test
+    def test_backpressure(self):
+        self.collection.blocked = Future()
+        writes = [self.queue.put(n, {'n': n}) for n in range(3)]
+        yield tornado.gen.moment
+        self.assertEqual(len(self.collection.writes), 1)
+
+        writes += [self.queue.put(n, {'n': n}) for n in range(3, 8)]
+        yield tornado.gen.moment
+        # the first batch is being written, one write waits for a place
+        self.assertEqual(len(self.queue), 4)
+
+        self.collection.blocked.set_result(None)
+        yield writes
+        written = [_id for write in self.collection.writes for _id, _ in write]
+        self.assertEqual(sorted(written), list(range(8)))
+
+    @tornado.testing.gen_test
+    def test_discard_waiting_write(self):
+        self.collection.blocked = Future()
+        writes = [self.queue.put(n, {'n': n}) for n in range(7)]
+        yield tornado.gen.moment
+
+        # the document is removed while its write waits for a place
+        waiting = self.queue.put(7, {'n': 7})
+        yield self.queue.discard(7)
+
+        self.collection.blocked.set_result(None)
+        yield writes + [waiting]
+        written = [_id for write in self.collection.writes for _id, _ in write]
+        self.assertEqual(sorted(written), list(range(7)))
+        self.assertFalse(self.queue._discarded)
+
+    @tornado.testing.gen_test
+    def test_discard(self):
+        write = self.queue.put(1, {'score': 1})
+        yield self.queue.discard(1)
+        yield write
+        yield self.queue.flush()
+        self.assertEqual(self.collection.writes, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,6 @@
+import collections
 import email.mime.text
+import time
 import uuid
 import multiprocessing.pool
 
@@ -7,8 +9,55 @@ import tornado.gen
 import settings
 
 
+class UserCache(object):
+    """
+    Users by token. Users expire after `ttl` seconds, the least recently
+    used ones are dropped when there are more than `max_size`.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        # token -> (expiration time, user), least recently used first
+        self._users = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._users)
+
+    def get(self, token):
+        expires, user = self._users.get(token, (0, None))
+        if user is None:
+            return None
+        if expires <= time.monotonic():
+            del self._users[token]
+            return None
+
+        self._users.move_to_end(token)
+        return user
+
+    def put(self, token, user):
+        self._users[token] = (time.monotonic() + self.ttl, user)
+        self._users.move_to_end(token)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+
+    def invalidate(self, user):
+        """
+        Drop the user, also when cached under an old token.
+        """
+        self._users.pop(user.token, None)
+        if user.id is not None:
+            for token, (expires, cached) in list(self._users.items()):
+                if cached.id == user.id:
+                    del self._users[token]
+
+    def clear(self):
+        self._users.clear()
+
+
 class User(object):
     collection = settings.db['users']
+    cache = UserCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
 
     def __init__(self, login, **kwargs):
         self.id = kwargs.get('_id')
@@ -36,8 +85,18 @@ class User(object):
         if not query:
             return None
 
+        # users signing in by token are cached, unknown tokens are not
+        by_token = token and not login
+        if by_token:
+            user = User.cache.get(token)
+            if user is not None:
+                return user
+
         user = yield User.collection.find_one(query)
-        return cls(**user) if user else None
+        user = cls(**user) if user else None
+        if by_token and user is not None:
+            User.cache.put(token, user)
+        return user
 
     @tornado.gen.coroutine
     def put(self):
@@ -53,3 +112,4 @@ class User(object):
             user['_id'] = self.id
 
         self.id = yield User.collection.save(user)
+        User.cache.invalidate(self)
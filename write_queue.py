@@ -0,0 +1,138 @@
+import collections
+import logging
+
+import pymongo
+import tornado.gen
+import tornado.locks
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+log = logging.getLogger('grot-server')
+
+
+class WriteQueue(object):
+    """
+    Write-behind queue of whole documents of one collection.
+
+    Documents are replaced (upserted) in bulk writes, every `interval`
+    seconds or as soon as `batch_size` documents wait. Repeated writes of
+    the same document before it is sent are merged, only the last version is
+    written. Only one bulk write is sent at a time; when `max_pending`
+    documents wait for it, new writes wait too.
+    """
+
+    def __init__(self, collection, interval=1, batch_size=100,
+                 max_pending=1000):
+        self.collection = collection
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+        # _id -> (document, future resolved when it is written)
+        self._pending = collections.OrderedDict()
+        self._in_flight = {}
+        self._flushing = False
+        self._timeout = None
+        self._flushed = tornado.locks.Condition()
+        # writes waiting for a place by _id, and those of them discarded
+        # while they wait
+        self._waiting = collections.Counter()
+        self._discarded = set()
+
+    def __len__(self):
+        return len(self._pending)
+
+    @tornado.gen.coroutine
+    def put(self, _id, document):
+        """
+        Queue the document to be written, wait until it is written. The
+        write is dropped if the document is discarded while it waits for a
+        place.
+        """
+        if self._is_full(_id):
+            self._waiting[_id] += 1
+            try:
+                while self._is_full(_id):
+                    yield self._flushed.wait()
+            finally:
+                self._waiting[_id] -= 1
+                discarded = _id in self._discarded
+                if not self._waiting[_id]:
+                    del self._waiting[_id]
+                    self._discarded.discard(_id)
+            if discarded:
+                return
+
+        try:
+            future = self._pending.pop(_id)[1]
+        except KeyError:
+            future = Future()
+        self._pending[_id] = (document, future)
+
+        if len(self._pending) >= self.batch_size:
+            IOLoop.current().spawn_callback(self.flush)
+        elif self._timeout is None and not self._flushing:
+            self._timeout = IOLoop.current().call_later(
+                self.interval, self.flush
+            )
+
+        yield future
+
+    def _is_full(self, _id):
+        return len(self._pending) >= self.max_pending and \
+            _id not in self._pending
+
+    @tornado.gen.coroutine
+    def discard(self, _id):
+        """
+        Drop the queued write of the document and writes waiting for a
+        place, wait for its write already sent to the database.
+        """
+        if _id in self._waiting:
+            self._discarded.add(_id)
+        entry = self._pending.pop(_id, None)
+        if entry is not None:
+            entry[1].set_result(None)
+
+        while _id in self._in_flight:
+            yield self._flushed.wait()
+
+    @tornado.gen.coroutine
+    def flush(self):
+        """
+        Write all queued documents.
+        """
+        if self._timeout is not None:
+            IOLoop.current().remove_timeout(self._timeout)
+            self._timeout = None
+        if self._flushing:
+            return
+
+        self._flushing = True
+        try:
+            while self._pending:
+                count = min(self.batch_size, len(self._pending))
+                self._in_flight = dict(
+                    self._pending.popitem(last=False) for _ in range(count)
+                )
+                yield self._write(self._in_flight)
+                self._in_flight = {}
+                self._flushed.notify_all()
+        finally:
+            self._flushing = False
+
+    @tornado.gen.coroutine
+    def _write(self, batch):
+        requests = [
+            pymongo.ReplaceOne({'_id': _id}, document, upsert=True)
+            for _id, (document, future) in batch.items()
+        ]
+        try:
+            yield self.collection.bulk_write(requests, ordered=False)
+        except Exception as e:
+            log.exception('Writing %s documents failed.', len(requests))
+            for document, future in batch.values():
+                future.set_exception(e)
+        else:
+            for document, future in batch.values():
+                future.set_result(None)